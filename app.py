@@ -1,4 +1,6 @@
+import logging
 from flask import Flask, render_template
+from flask.logging import default_handler
 from config import Config
 from models import db
 import os
@@ -9,9 +11,19 @@ def create_app(config_class=Config):
 
     db.init_app(app)
 
-    # Ensure upload and qr folders exist
+    from services import omr_cache, omr_trace
+    omr_cache.configure(app.config['OMR_CACHE_SIZE'], app.config['OMR_CACHE_DIR'], app.config['OMR_CACHE_DISK_MAX_BYTES'])
+    omr_trace.configure(sample_rate=app.config['OMR_DEBUG_SAMPLE_RATE'], dump_dir=app.config['OMR_DEBUG_DIR'],
+                        max_dumps=app.config['OMR_DEBUG_MAX_SHEETS'], slow_seconds=app.config['OMR_SLOW_SHEET_SECONDS'])
+
+    # OMR stage timings (slow sheets are logged as warnings)
+    omr_logger = logging.getLogger('omr')
+    omr_logger.setLevel(app.config['OMR_LOG_LEVEL'])
+    if not omr_logger.handlers:
+        omr_logger.addHandler(default_handler)
+
+    # Ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['QR_FOLDER'], exist_ok=True)
 
     with app.app_context():
         db.create_all()
@@ -26,6 +38,10 @@ def create_app(config_class=Config):
             db.session.add(admin)
             db.session.commit()
             print("Admin user created.")
+
+        # Question counts per category and difficulty (also registers their upkeep)
+        from services import question_counts
+        question_counts.ensure_counts()
             
         # Migrate Courses (Legacy - Commented out to prevent startup errors during schema updates)
         # from models import Exam, Course
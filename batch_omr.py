@@ -0,0 +1,27 @@
+import argparse
+
+from app import create_app
+from services.batch_omr_service import process_batch
+
+parser = argparse.ArgumentParser(description="Corrige em lote um diretório, ZIP ou TIFF de gabaritos digitalizados.")
+parser.add_argument('source', help="Diretório, arquivo ZIP ou TIFF de várias páginas com as imagens")
+parser.add_argument('--exam-id', type=int, help="Restringe a correção às versões desta prova")
+parser.add_argument('--workers', type=int, help="Número de processos (padrão: OMR_WORKERS)")
+parser.add_argument('--commit-size', type=int, help="Envios por commit (padrão: OMR_BATCH_COMMIT_SIZE)")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    app = create_app()
+
+    with app.app_context():
+        report = process_batch(args.source, exam_id=args.exam_id, workers=args.workers, commit_size=args.commit_size)
+
+    for sheet in report['sheets']:
+        score = f"{sheet['score']:.1f}" if sheet['score'] is not None else '-'
+        review = 'revisar' if sheet['needs_review'] else ''
+        print(f"{sheet['name']}\t{sheet.get('version_label', '-')}\t{sheet['status']}\t{score}\t{sheet['seconds']:.2f}s\t{review}\t{sheet['message']}")
+
+    summary = report['summary']
+    print(f"\n{summary['total']} imagens, {summary['saved']} registradas, {summary['skipped']} ignoradas, {summary['errors']} com erro")
+    print(f"{summary['auto_accepted']} aceitas automaticamente, {summary['review']} para revisão")
+    print(f"{summary['sheets_per_second']:.1f} folhas/s com {summary['workers']} processos ({summary['elapsed']:.1f} s)")
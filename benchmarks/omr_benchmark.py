@@ -0,0 +1,206 @@
+"""
+Accuracy and throughput of the OMR on synthetic answer sheets.
+
+Sheets are rendered from the layouts of the stored exam versions (or of
+generated exams with --questions), degraded like phone photos and read
+with services.omr_service.process_exam_image from the JPEG bytes, so the
+decode is part of the timing.
+
+    python benchmarks/omr_benchmark.py --sheets 200 --output omr.json
+    python benchmarks/omr_benchmark.py --questions 20 40 --baseline omr.json
+
+With --baseline the run is compared to a previous JSON report and the
+script exits with status 1 when throughput, p95 latency or accuracy got
+worse than --tolerance allows.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+
+sys.path.append(os.getcwd())
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import version_layouts, random_answers, render_sheet, degrade
+from services.layout_service import build_layout
+from services.omr_service import process_exam_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None when unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_layouts(args, rng):
+    if args.questions:
+        return [(f"synthetic-{n}", build_layout([int(rng.integers(4, 6)) for _ in range(n)]))
+                for n in args.questions]
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        layouts = version_layouts(args.exam_id, args.max_versions)
+    if not layouts:
+        sys.exit("No exam versions in the database; use --questions to generate layouts")
+    return layouts
+
+
+def make_sheets(layouts, args, rng):
+    distortion = {
+        'rotation': args.rotation, 'perspective': args.perspective, 'lighting': args.lighting,
+        'blur': args.blur, 'noise': args.noise, 'jpeg_quality': args.jpeg_quality,
+    }
+    sheets = []
+    for i in range(args.sheets):
+        label, layout = layouts[i % len(layouts)]
+        expected = random_answers(layout, rng, args.blank_rate)
+        page = render_sheet(layout, expected, px_per_mm=args.px_per_mm, rng=rng)
+        sheets.append((label, layout, expected, degrade(page, rng, **distortion)))
+    return sheets
+
+
+def run(sheets, warmup=1):
+    for label, layout, expected, data in sheets[:warmup]:
+        process_exam_image(data, len(layout['alternatives']), layout['alternatives'], layout=layout)
+
+    rss_before = peak_rss()
+    latencies = []
+    counts = {'questions': 0, 'correct': 0, 'missed': 0, 'spurious': 0, 'wrong': 0,
+              'sheets_correct': 0, 'errors': 0}
+    failures = []
+
+    start = time.perf_counter()
+    for label, layout, expected, data in sheets:
+        t0 = time.perf_counter()
+        try:
+            answers = process_exam_image(data, len(layout['alternatives']), layout['alternatives'], layout=layout)
+        except Exception as e:
+            counts['errors'] += 1
+            failures.append({'version': label, 'error': str(e)})
+            answers = {}
+        latencies.append(time.perf_counter() - t0)
+
+        sheet_ok = True
+        for number, want in expected.items():
+            got = answers.get(number)
+            counts['questions'] += 1
+            if got == want:
+                counts['correct'] += 1
+                continue
+            sheet_ok = False
+            if got is None:
+                counts['missed'] += 1
+            elif want is None:
+                counts['spurious'] += 1
+            else:
+                counts['wrong'] += 1
+        counts['sheets_correct'] += sheet_ok
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    rss_after = peak_rss()
+    return {
+        'sheets': len(sheets),
+        'elapsed_seconds': round(elapsed, 3),
+        'sheets_per_second': round(len(sheets) / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 2),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 2),
+            'mean': round(float(latencies_ms.mean()), 2),
+            'max': round(float(latencies_ms.max()), 2),
+        },
+        'peak_rss_mb': round(rss_after / 2**20, 1) if rss_after else None,
+        'peak_rss_growth_mb': round((rss_after - rss_before) / 2**20, 1) if rss_after else None,
+        'question_accuracy': round(counts['correct'] / counts['questions'], 5) if counts['questions'] else None,
+        'sheet_accuracy': round(counts['sheets_correct'] / len(sheets), 5),
+        'counts': counts,
+        'failures': failures[:20],
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of report against baseline, as readable strings."""
+    new, old = report['results'], baseline['results']
+    problems = []
+    if new['sheets_per_second'] < old['sheets_per_second'] * (1 - tolerance):
+        problems.append(f"throughput {old['sheets_per_second']} -> {new['sheets_per_second']} sheets/s")
+    if new['latency_ms']['p95'] > old['latency_ms']['p95'] * (1 + tolerance):
+        problems.append(f"p95 latency {old['latency_ms']['p95']} -> {new['latency_ms']['p95']} ms")
+    if (new['question_accuracy'] or 0) < (old['question_accuracy'] or 0):
+        problems.append(f"question accuracy {old['question_accuracy']} -> {new['question_accuracy']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=100)
+    parser.add_argument('--questions', type=int, nargs='*', help="Generate exams with these question counts instead of using the database")
+    parser.add_argument('--exam-id', type=int, help="Only use versions of this exam")
+    parser.add_argument('--max-versions', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--px-per-mm', type=float, default=8.0, help="Page resolution before distortion")
+    parser.add_argument('--rotation', type=float, default=4.0, help="Maximum rotation (degrees)")
+    parser.add_argument('--perspective', type=float, default=0.04)
+    parser.add_argument('--lighting', type=float, default=0.35)
+    parser.add_argument('--blur', type=float, default=1.2, help="Maximum blur sigma (pixels)")
+    parser.add_argument('--noise', type=float, default=5.0)
+    parser.add_argument('--jpeg-quality', type=int, default=75)
+    parser.add_argument('--blank-rate', type=float, default=0.05)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--baseline', help="Previous JSON report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    layouts = load_layouts(args, rng)
+    sheets = make_sheets(layouts, args, rng)
+    results = run(sheets)
+
+    report = {
+        'benchmark': 'omr',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': dict(vars(args), versions=[label for label, _ in layouts]),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'opencv_threads': cv2.getNumThreads(),
+        },
+        'results': results,
+    }
+
+    print(f"{results['sheets']} sheets from {len(layouts)} layouts: {results['sheets_per_second']} sheets/s, "
+          f"p50 {results['latency_ms']['p50']} ms, p95 {results['latency_ms']['p95']} ms, "
+          f"peak RSS {results['peak_rss_mb']} MB")
+    print(f"question accuracy {results['question_accuracy']}, sheet accuracy {results['sheet_accuracy']}, "
+          f"{results['counts']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares table detection at full resolution against the coarse pyramid
+level used by services.omr_service.read_answers.
+
+    python benchmarks/pyramid_benchmark.py gabarito.jpg --questions 2 --grid 4 --upscale 12
+    python benchmarks/pyramid_benchmark.py --synthetic 20
+
+For each image both paths are run `--repeat` times; the report shows the
+median latency, the peak memory allocated by the OMR and whether both
+paths read the same answers.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import tracemalloc
+
+sys.path.append(os.getcwd())
+
+import cv2
+
+from benchmarks.synthetic import render_table_sheet
+from services.omr_service import read_answers, SHEET_ALTERNATIVES
+
+
+def measure(gray, num_questions, grid, levels, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        answers = read_answers(gray, num_questions, grid_alternatives=grid, detect_levels=levels)
+        times.append(time.perf_counter() - start)
+
+    # NumPy (and OpenCV outputs) allocations are visible to tracemalloc
+    tracemalloc.start()
+    read_answers(gray, num_questions, grid_alternatives=grid, detect_levels=levels)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return answers, statistics.median(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--grid', type=int, default=SHEET_ALTERNATIVES, help="Alternative columns printed")
+    parser.add_argument('--upscale', type=float, default=1.0, help="Resize the images to simulate phone photos")
+    parser.add_argument('--synthetic', type=int, default=0, help="Also run on this many synthetic 12 MP sheets")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = []
+    for path in args.images:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            sys.exit(f"Could not load {path}")
+        if args.upscale != 1.0:
+            gray = cv2.resize(gray, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_CUBIC)
+        cases.append((path, gray, args.questions, args.grid, None))
+    for i in range(args.synthetic):
+        gray, expected = render_table_sheet(args.questions, args.grid, seed=i)
+        cases.append((f"synthetic-{i}", gray, args.questions, args.grid, expected))
+
+    if not cases:
+        parser.error("give at least one image or --synthetic N")
+
+    print(f"{'image':<24}{'size':>12}{'full (ms)':>11}{'pyr (ms)':>10}{'full MB':>9}{'pyr MB':>8}  same  correct")
+    totals = {'full': 0.0, 'pyramid': 0.0, 'same': 0, 'correct_full': 0, 'correct_pyramid': 0, 'expected': 0}
+    for name, gray, num_questions, grid, expected in cases:
+        full, t_full, m_full = measure(gray, num_questions, grid, 0, args.repeat)
+        pyr, t_pyr, m_pyr = measure(gray, num_questions, grid, None, args.repeat)
+
+        totals['full'] += t_full
+        totals['pyramid'] += t_pyr
+        totals['same'] += full == pyr
+        correct = '-'
+        if expected is not None:
+            totals['expected'] += 1
+            totals['correct_full'] += full == expected
+            totals['correct_pyramid'] += pyr == expected
+            correct = f"{full == expected}/{pyr == expected}"
+
+        size = f"{gray.shape[1]}x{gray.shape[0]}"
+        print(f"{name[:23]:<24}{size:>12}{t_full * 1000:>11.1f}{t_pyr * 1000:>10.1f}"
+              f"{m_full / 2**20:>9.1f}{m_pyr / 2**20:>8.1f}  {str(full == pyr):<5} {correct}")
+
+    print(f"\nspeedup {totals['full'] / totals['pyramid']:.1f}x, "
+          f"identical answers on {totals['same']}/{len(cases)} images")
+    if totals['expected']:
+        print(f"correct sheets: full {totals['correct_full']}/{totals['expected']}, "
+              f"pyramid {totals['correct_pyramid']}/{totals['expected']}")
+
+
+if __name__ == '__main__':
+    main()
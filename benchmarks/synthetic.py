@@ -0,0 +1,188 @@
+"""
+Synthetic answer sheets for the OMR benchmarks.
+
+render_sheet draws the fiducial answer grid of a layout (as printed by
+latex_service.answer_grid_tikz) on an A4 page with some marked bubbles;
+degrade turns it into what a phone or scanner delivers: a rotated,
+perspective-distorted, unevenly lit, blurred and noisy JPEG.
+render_table_sheet draws the old answer table read by table detection.
+"""
+import cv2
+import numpy as np
+
+from services.layout_service import build_layout, load_layout, marker_bits, version_alternatives, OPTIONS
+
+A4_MM = (210.0, 297.0)
+PAPER = 235
+INK = 25
+
+
+def version_layouts(exam_id=None, limit=None):
+    """
+    Layouts of the stored versions (computed, not saved, for versions never printed).
+    Needs an application context.
+
+    Returns:
+        list: (label, layout) tuples.
+    """
+    from models import ExamVersion
+
+    query = ExamVersion.query.order_by(ExamVersion.id)
+    if exam_id:
+        query = query.filter_by(exam_id=exam_id)
+    if limit:
+        query = query.limit(limit)
+
+    return [
+        (f"{version.exam_id}-{version.label}", load_layout(version) or build_layout(version_alternatives(version)))
+        for version in query if version.questions
+    ]
+
+
+def random_answers(layout, rng, blank_rate=0.05):
+    """Expected answers {question: letter or None}, with about blank_rate blank questions."""
+    return {
+        number: None if rng.random() < blank_rate else OPTIONS[int(rng.integers(alternatives))]
+        for number, alternatives in enumerate(layout['alternatives'], start=1)
+    }
+
+
+def render_sheet(layout, answers, px_per_mm=8, rng=None, offset_mm=(20.0, 60.0)):
+    """
+    Draw a clean A4 page with the answer grid of `layout`.
+
+    Args:
+        layout (dict): layout_service descriptor.
+        answers (dict): question -> letter to fill (None leaves it blank).
+        px_per_mm (float): Resolution (8 px/mm is about 200 dpi).
+        rng: numpy Generator used to vary the marks. Defaults to seed 0.
+        offset_mm (tuple): Position of the grid on the page.
+
+    Returns:
+        ndarray: Grayscale page.
+    """
+    rng = rng or np.random.default_rng(0)
+    width, height = (int(side * px_per_mm) for side in A4_MM)
+    img = np.full((height, width), PAPER, np.uint8)
+    ox, oy = offset_mm
+
+    def px(x, y):
+        return int(round((ox + x) * px_per_mm)), int(round((oy + y) * px_per_mm))
+
+    # Some page content above the grid, as on a real exam
+    for line in range(4):
+        cv2.putText(img, "Prova - Nome: ____________________ Turma: ______", px(0, -45 + line * 9),
+                    cv2.FONT_HERSHEY_SIMPLEX, px_per_mm * 0.18, INK, max(1, int(px_per_mm * 0.2)))
+
+    module_count = len(marker_bits(0, layout['dictionary']))
+    module = layout['marker_size'] / module_count
+    for marker_id, (x, y) in layout['markers'].items():
+        for r, row in enumerate(marker_bits(int(marker_id), layout['dictionary'])):
+            for c, black in enumerate(row):
+                if black:
+                    cv2.rectangle(img, px(x + c * module, y + r * module),
+                                  px(x + (c + 1) * module, y + (r + 1) * module), 0, -1)
+
+    radius = layout['bubble_radius'] * px_per_mm
+    font_scale = px_per_mm * 0.11
+    for header in layout['headers']:
+        for a, (x, y) in enumerate(header):
+            cv2.putText(img, OPTIONS[a], px(x - 1, y + 1.2), cv2.FONT_HERSHEY_SIMPLEX, font_scale, INK, 1)
+    for number, ((x, y), cells) in enumerate(zip(layout['numbers'], layout['cells']), start=1):
+        cv2.putText(img, str(number), px(x - 2.5, y + 1.2), cv2.FONT_HERSHEY_SIMPLEX, font_scale, INK, 1)
+        for a, (cx, cy) in enumerate(cells):
+            centre = px(cx, cy)
+            cv2.circle(img, centre, int(radius), INK, max(1, int(px_per_mm * 0.15)), cv2.LINE_AA)
+            if answers.get(number) == OPTIONS[a]:
+                # Pencil marks: not always dark, not always filling the bubble
+                ink = int(rng.integers(INK, 110))
+                cv2.circle(img, centre, int(radius * rng.uniform(0.7, 0.95)), ink, -1, cv2.LINE_AA)
+
+    return img
+
+
+def render_table_sheet(num_questions, num_alternatives=5, size=(4000, 3000), seed=0):
+    """A 12 MP photo of the old answer table with one X per question, slightly rotated."""
+    rng = np.random.default_rng(seed)
+    height, width = size
+    img = np.full((height, width), PAPER, np.uint8)
+
+    cols = num_alternatives + 1
+    cell_w = (width - 600) // cols
+    cell_h = min(150, (height - 600) // (num_questions + 1))
+    x0, y0 = 300, 300
+
+    for r in range(num_questions + 2):
+        cv2.line(img, (x0, y0 + r * cell_h), (x0 + cols * cell_w, y0 + r * cell_h), 20, 6)
+    for c in range(cols + 1):
+        cv2.line(img, (x0 + c * cell_w, y0), (x0 + c * cell_w, y0 + (num_questions + 1) * cell_h), 20, 6)
+
+    expected = {}
+    for q in range(1, num_questions + 1):
+        a = int(rng.integers(num_alternatives))
+        expected[q] = OPTIONS[a]
+        left, top = x0 + (a + 1) * cell_w + 30, y0 + q * cell_h + 30
+        right, bottom = left + cell_w - 60, top + cell_h - 60
+        cv2.line(img, (left, top), (right, bottom), 30, 12)
+        cv2.line(img, (right, top), (left, bottom), 30, 12)
+
+    M = cv2.getRotationMatrix2D((width / 2, height / 2), 3, 1.0)
+    img = cv2.warpAffine(img, M, (width, height), borderValue=PAPER)
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8), expected
+
+
+def degrade(img, rng, rotation=4.0, perspective=0.04, lighting=0.35, blur=1.2, noise=5.0,
+            jpeg_quality=75, background=90):
+    """
+    Simulate a photo of a printed page.
+
+    Args:
+        img (ndarray): Clean grayscale page.
+        rng: numpy Generator.
+        rotation (float): Maximum rotation, degrees.
+        perspective (float): Maximum corner displacement, fraction of the page size.
+        lighting (float): Maximum darkening across the page (0 keeps it even).
+        blur (float): Maximum Gaussian blur sigma, pixels.
+        noise (float): Sensor noise standard deviation.
+        jpeg_quality (int): JPEG quality, or None to return the raw image.
+        background (int): Gray level around the page.
+
+    Returns:
+        bytes or ndarray: The encoded JPEG (raw image if jpeg_quality is None).
+    """
+    height, width = img.shape
+    # Leave room around the page so rotated corners stay in the frame
+    pad = int(0.06 * max(height, width))
+    canvas = cv2.copyMakeBorder(img, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=background)
+    h, w = canvas.shape
+
+    angle = np.deg2rad(rng.uniform(-rotation, rotation))
+    centre = np.array([w / 2, h / 2])
+    rot = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    src = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    dst = (src - centre) @ rot.T + centre
+    dst += rng.uniform(-perspective, perspective, dst.shape) * [w, h]
+    M = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+    out = cv2.warpPerspective(canvas, M, (w, h), flags=cv2.INTER_LINEAR, borderValue=background)
+
+    if lighting:
+        direction = rng.uniform(-1, 1, 2)
+        yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+        ramp = (xx / w - 0.5) * direction[0] + (yy / h - 0.5) * direction[1]
+        ramp = (ramp - ramp.min()) / max(ramp.max() - ramp.min(), 1e-6)
+        out = out * (1.0 - lighting * ramp)
+
+    sigma = rng.uniform(0, blur)
+    if sigma > 0.3:
+        out = cv2.GaussianBlur(out.astype(np.float32), (0, 0), sigma)
+    if noise:
+        out = out + rng.normal(0, noise, out.shape)
+    out = np.clip(out, 0, 255).astype(np.uint8)
+
+    if jpeg_quality is None:
+        return out
+    ok, buf = cv2.imencode('.jpg', out, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])
+    if not ok:
+        raise ValueError("Could not encode the synthetic sheet")
+    return buf.tobytes()
@@ -5,4 +5,53 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
-    QR_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'qr_codes')
+
+    # Batch OMR ingestion
+    OMR_WORKERS = int(os.environ.get('OMR_WORKERS') or os.cpu_count() or 1)
+    OMR_BATCH_COMMIT_SIZE = 50
+
+    # Uploaded sheets are decoded in memory at 1/OMR_DECODE_REDUCTION of their
+    # size (1, 2, 4 or 8), unless that leaves less than OMR_DECODE_MIN_SIDE pixels
+    OMR_DECODE_REDUCTION = 2
+    OMR_DECODE_MIN_SIDE = 1000
+    # Keep a copy of the uploaded photos (written in the background)
+    OMR_KEEP_UPLOADS = True
+
+    # Background OMR: uploads are queued and graded by omr_worker.py
+    OMR_ASYNC = os.environ.get('OMR_ASYNC') == '1'
+    OMR_WORKER_CONCURRENCY = int(os.environ.get('OMR_WORKER_CONCURRENCY') or 2)
+    OMR_QUEUE_MAX_PENDING = 300  # Uploads beyond this are not queued (manual entry)
+    OMR_JOB_POLL_INTERVAL = 0.5  # Seconds an idle worker waits before polling again
+    OMR_JOB_STALE_SECONDS = 600  # Running jobs older than this are requeued at worker start
+    OMR_JOB_KEEP_SECONDS = 86400  # Finished jobs older than this are deleted at worker start
+
+    # Web and worker processes share the SQLite file; wait for locks instead of failing
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}} if SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {}
+
+    # OMR results memoized by image hash (services/omr_cache.py)
+    OMR_CACHE_SIZE = 256
+    OMR_CACHE_DIR = os.environ.get('OMR_CACHE_DIR')  # Also keep results on disk (shared by all processes)
+    OMR_CACHE_DISK_MAX_BYTES = 64 * 1024 * 1024  # Least recently used results on disk are deleted beyond this
+
+    # OMR stage timings (services/omr_trace.py). A fraction of the sheets can
+    # have their intermediate images written to OMR_DEBUG_DIR, which keeps
+    # only the newest OMR_DEBUG_MAX_SHEETS sheets.
+    OMR_LOG_LEVEL = os.environ.get('OMR_LOG_LEVEL') or 'WARNING'
+    OMR_SLOW_SHEET_SECONDS = 2.0
+    OMR_DEBUG_SAMPLE_RATE = float(os.environ.get('OMR_DEBUG_SAMPLE_RATE') or 0)
+    OMR_DEBUG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'omr_debug')
+    OMR_DEBUG_MAX_SHEETS = 50
+
+    # Exam generation: maximum fraction of the versions a question may appear
+    # in (services/selection_service.py), the default of the create form.
+    # None only balances the exposure: within a (category, difficulty), no
+    # question appears in more than one version more than any other, however
+    # small the pool, and the exam is never refused for it.
+    EXAM_MAX_EXPOSURE = float(os.environ['EXAM_MAX_EXPOSURE']) if os.environ.get('EXAM_MAX_EXPOSURE') else None
+    # Generate exams in omr_worker.py instead of inside the request
+    EXAM_BUILD_ASYNC = os.environ.get('EXAM_BUILD_ASYNC') == '1'
+
+    # Compiled exam PDFs, reused while the rendered LaTeX does not change (services/pdf_service.py)
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'pdf_cache')
+    PDF_CACHE_MAX_BYTES = 200 * 2**20
+    PDF_WORKERS = int(os.environ.get('PDF_WORKERS') or os.cpu_count() or 1)  # Versions compiled at the same time
@@ -0,0 +1,26 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+from app import create_app
+from models import db
+from sqlalchemy import text
+
+app = create_app()
+
+with app.app_context():
+    try:
+        # Check if column exists
+        with db.engine.connect() as conn:
+            result = conn.execute(text("PRAGMA table_info(exam_version)"))
+            columns = [row.name for row in result]
+            
+            if 'layout' not in columns:
+                print("Adding 'layout' column to 'exam_version' table...")
+                conn.execute(text("ALTER TABLE exam_version ADD COLUMN layout TEXT"))
+                conn.commit()
+                print("Column added successfully.")
+            else:
+                print("Column 'layout' already exists.")
+                
+    except Exception as e:
+        print(f"An error occurred: {e}")
@@ -0,0 +1,34 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+from app import create_app
+from models import db
+from sqlalchemy import text
+
+app = create_app()
+
+with app.app_context():
+    try:
+        # Check if columns exist
+        with db.engine.connect() as conn:
+            result = conn.execute(text("PRAGMA table_info(student_submission)"))
+            columns = [row.name for row in result]
+            
+            if 'omr_data' not in columns:
+                print("Adding 'omr_data' column to 'student_submission' table...")
+                conn.execute(text("ALTER TABLE student_submission ADD COLUMN omr_data TEXT"))
+                print("Column added successfully.")
+            else:
+                print("Column 'omr_data' already exists.")
+
+            if 'needs_review' not in columns:
+                print("Adding 'needs_review' column to 'student_submission' table...")
+                conn.execute(text("ALTER TABLE student_submission ADD COLUMN needs_review BOOLEAN DEFAULT 0 NOT NULL"))
+                print("Column added successfully.")
+            else:
+                print("Column 'needs_review' already exists.")
+
+            conn.commit()
+                
+    except Exception as e:
+        print(f"An error occurred: {e}")
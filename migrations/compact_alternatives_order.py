@@ -0,0 +1,40 @@
+import sys
+import os
+import json
+sys.path.append(os.getcwd())
+from app import create_app
+from models import db
+from sqlalchemy import text
+
+app = create_app()
+
+with app.app_context():
+    try:
+        with db.engine.connect() as conn:
+            # Check if column exists
+            result = conn.execute(text("PRAGMA table_info(exam_version)"))
+            columns = [row.name for row in result]
+
+            if 'seed' not in columns:
+                print("Adding 'seed' column to 'exam_version' table...")
+                conn.execute(text("ALTER TABLE exam_version ADD COLUMN seed INTEGER"))
+                print("Column added successfully.")
+            else:
+                print("Column 'seed' already exists.")
+
+            # ["C", "A", "D", "B"] -> "CADB"
+            rows = conn.execute(text("SELECT id, alternatives_order FROM exam_question WHERE alternatives_order LIKE '[%'")).all()
+            if rows:
+                print(f"Compacting the alternatives order of {len(rows)} questions...")
+                conn.execute(
+                    text("UPDATE exam_question SET alternatives_order = :order WHERE id = :id"),
+                    [{'id': row.id, 'order': ''.join(json.loads(row.alternatives_order))} for row in rows]
+                )
+                print("Alternatives order compacted successfully.")
+            else:
+                print("Alternatives order already compact.")
+
+            conn.commit()
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
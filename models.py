@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 import json
+import random
 from datetime import datetime
+from functools import lru_cache
 
 db = SQLAlchemy()
 
@@ -31,6 +33,12 @@ class Question(db.Model):
 
     category = db.relationship('Category', backref=db.backref('questions', lazy=True))
 
+class QuestionCount(db.Model):
+    """Questions per category and difficulty, kept up to date by services/question_counts.py."""
+    category_id = db.Column(db.Integer, primary_key=True)
+    difficulty = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
@@ -55,9 +63,22 @@ class ExamVersion(db.Model):
     exam_id = db.Column(db.Integer, db.ForeignKey('exam.id'), nullable=False)
     label = db.Column(db.String(10), nullable=False) # e.g., "A", "B", "1", "2"
     unique_code = db.Column(db.String(36), unique=True, nullable=False) # UUID for QR
+    layout = db.Column(db.Text) # JSON answer grid geometry (layout_service), set when the version is first printed
+    seed = db.Column(db.Integer) # PRNG seed the alternative orders are rebuilt from (version_permutations), NULL for old versions
     
     questions = db.relationship('ExamQuestion', backref='version', lazy=True, order_by='ExamQuestion.question_number')
 
+    def alternative_orders(self):
+        """Original keys in printed order of every question, in question order; computed once per version."""
+        orders = self.__dict__.get('_alternative_orders')
+        if orders is None:
+            if self.seed is None:
+                orders = tuple(parse_alternatives_order(eq.alternatives_order) for eq in self.questions)
+            else:
+                orders = version_permutations(self.seed, tuple(int(eq.alternatives_order) for eq in self.questions))
+            self._alternative_orders = orders
+        return orders
+
 class ExamQuestion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     version_id = db.Column(db.Integer, db.ForeignKey('exam_version.id'), nullable=False)
@@ -69,16 +90,47 @@ class ExamQuestion(db.Model):
     
     # Store how alternatives were shuffled: e.g., {"A": "alt_c_content", "B": "alt_a_content", ...} 
     # OR simpler: just store the mapping of original letters to new positions?
-    # Let's store the order of original keys: e.g. ["C", "A", "D", "B"] means:
+    # Let's store the order of original keys: e.g. "CADB" means:
     # Position A has content of original C
     # Position B has content of original A
     # ...
-    alternatives_order = db.Column(db.String(200), nullable=False) # JSON string
+    # Versions generated before the compact format store a JSON list (["C", "A", "D", "B"]).
+    # Versions with a seed only store the number of alternatives ("4"): the
+    # order itself is rebuilt from ExamVersion.seed.
+    alternatives_order = db.Column(db.String(200), nullable=False)
 
     question = db.relationship('Question')
 
     def get_alternatives_order(self):
-        return json.loads(self.alternatives_order)
+        return self.version.alternative_orders()[self.question_number - 1]
+
+# There are only a few hundred distinct orders, so every one is parsed once
+@lru_cache(maxsize=1024)
+def parse_alternatives_order(value):
+    """Original keys in printed order, e.g. ('C', 'A', 'D', 'B'), from the compact or the JSON form."""
+    if value.startswith('['):
+        return tuple(json.loads(value))
+    return tuple(value)
+
+@lru_cache(maxsize=256)
+def version_permutations(seed, num_alternatives):
+    """
+    Alternative orders of a version, drawn from its seed.
+
+    Args:
+        seed (int): ExamVersion.seed.
+        num_alternatives (tuple): Alternatives of each question, in question order.
+
+    Returns:
+        tuple: Original keys in printed order of each question, e.g. ('C', 'A', 'D', 'B').
+    """
+    rng = random.Random(seed)
+    orders = []
+    for count in num_alternatives:
+        keys = list('ABCDE'[:count])
+        rng.shuffle(keys)
+        orders.append(tuple(keys))
+    return tuple(orders)
 
 class StudentSubmission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -91,9 +143,34 @@ class StudentSubmission(db.Model):
     answers = db.Column(db.Text) # JSON string of answers
     score = db.Column(db.Float)
     total_questions = db.Column(db.Integer)
+    omr_data = db.Column(db.Text) # JSON OMR states and confidence per question
+    needs_review = db.Column(db.Boolean, default=False, nullable=False) # Low-confidence OMR read
     
     version = db.relationship('ExamVersion', backref='submissions')
 
+class BackgroundJob(db.Model):
+    """Persistent work queue consumed by omr_worker.py (see services/job_queue.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False, index=True) # Handler name, e.g. 'omr_upload'
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True) # pending, running, done, error, cancelled
+    payload = db.Column(db.Text) # JSON handler arguments
+    blob = db.Column(db.LargeBinary) # Binary input (e.g. the uploaded photo), cleared when the job finishes
+    result = db.Column(db.Text) # JSON handler result
+    error = db.Column(db.Text)
+    progress = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer, default=0, nullable=False)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    worker = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def get_payload(self):
+        return json.loads(self.payload) if self.payload else {}
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -0,0 +1,45 @@
+import argparse
+import multiprocessing
+
+from app import create_app
+from services import job_queue
+import services.omr_jobs  # noqa: F401 (registers the OMR job handlers)
+import services.exam_jobs  # noqa: F401 (registers the exam generation handler)
+
+parser = argparse.ArgumentParser(description="Processa a fila de trabalhos em segundo plano (correção automática e geração de provas).")
+parser.add_argument('--concurrency', type=int, help="Número de processos (padrão: OMR_WORKER_CONCURRENCY)")
+parser.add_argument('--once', action='store_true', help="Processa os trabalhos pendentes e termina")
+
+
+def run_worker(once):
+    import cv2
+    # Several workers share the machine with the web app
+    cv2.setNumThreads(1)
+
+    app = create_app()
+    with app.app_context():
+        job_queue.work(poll_interval=app.config['OMR_JOB_POLL_INTERVAL'], until_empty=once)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    app = create_app()
+
+    with app.app_context():
+        requeued = job_queue.requeue_stale(app.config['OMR_JOB_STALE_SECONDS'])
+        purged = job_queue.purge_finished(app.config['OMR_JOB_KEEP_SECONDS'])
+    if requeued or purged:
+        print(f"{requeued} trabalhos interrompidos voltaram para a fila, {purged} trabalhos antigos removidos")
+
+    concurrency = args.concurrency or app.config['OMR_WORKER_CONCURRENCY']
+    processes = [multiprocessing.Process(target=run_worker, args=(args.once,)) for _ in range(concurrency)]
+    for process in processes:
+        process.start()
+    print(f"{concurrency} processos aguardando trabalhos")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify
 from models import db, Exam, StudentSubmission, ExamVersion, ExamQuestion
 from routes.auth import login_required
 import json
@@ -300,3 +300,16 @@ def exam_stats(exam_id):
                            questions=paginated_questions,
                            current_page=page,
                            total_pages=total_pages)
+
+@bp.route('/omr_metrics')
+@login_required
+def omr_metrics():
+    """OMR stage timings, result cache and job queue counters of this web process (JSON)."""
+    from services import omr_trace, omr_cache, job_queue
+
+    return jsonify({
+        'trace': omr_trace.metrics(),
+        'cache': omr_cache.stats(),
+        'queue': job_queue.status_counts(),
+        'debug_dumps': omr_trace.settings(),
+    })
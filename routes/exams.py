@@ -1,9 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, make_response
-from models import db, Category, Exam, Course
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, make_response, current_app, jsonify, abort
+from models import db, Category, Exam, Course, BackgroundJob
 from services.exam_service import create_exam_logic
-from services.latex_service import generate_exam_latex
+from services.exam_jobs import enqueue_exam_build, listed_builds, EXAM_BUILD
+from services.question_counts import availability, check_feasibility
+from services.pdf_service import cached_pdfs, merged_pdf, zip_pdfs
+from services.job_queue import request_cancel, queue_position, FINISHED, RUNNING
+from services.latex_service import generate_exam_latex, generate_version_latex
 from routes.auth import login_required
 import io
+import hashlib
 
 import random
 
@@ -71,7 +76,7 @@ def list_exams():
                 
         exams = filtered_exams
 
-    return render_template('exams/list.html', exams=exams, courses=courses, selected_course_id=course_id, selected_start_date=start_date, selected_end_date=end_date)
+    return render_template('exams/list.html', exams=exams, builds=listed_builds(), courses=courses, selected_course_id=course_id, selected_start_date=start_date, selected_end_date=end_date)
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -133,10 +138,25 @@ def create_exam():
             'hard': int(request.form.get('pct_hard', 20))
         }
         
+        # Percentage of the versions a question may appear in; 100% is no cap
+        max_exposure = request.form.get('max_exposure', type=float) or 100
+        max_exposure = min(max(max_exposure, 1), 100) / 100
+
         try:
             show_resolution = 'show_resolution' in request.form
             max_grade = float(request.form.get('max_grade', 10.0))
-            create_exam_logic(title, date, course.name, course.id, total_questions, distribution, num_versions, show_resolution, max_grade, difficulty_config)
+            if current_app.config['EXAM_BUILD_ASYNC']:
+                # Large exams are built by omr_worker.py; the list shows the progress
+                check_feasibility(distribution)
+                enqueue_exam_build({
+                    'title': title, 'date': date, 'course_name': course.name, 'course_id': course.id,
+                    'total_questions_ignored': total_questions, 'distribution_config': distribution,
+                    'num_versions': num_versions, 'show_resolution': show_resolution, 'max_grade': max_grade,
+                    'difficulty_config': difficulty_config, 'max_exposure': max_exposure
+                })
+                flash(f'A prova "{title}" está sendo gerada.')
+                return redirect(url_for('exams.list_exams'))
+            create_exam_logic(title, date, course.name, course.id, total_questions, distribution, num_versions, show_resolution, max_grade, difficulty_config, max_exposure)
             flash('Prova gerada com sucesso!')
             return redirect(url_for('exams.list_exams'))
         except Exception as e:
@@ -145,7 +165,47 @@ def create_exam():
             traceback.print_exc()
             flash(f"Erro ao gerar prova: {str(e)}", 'error')
             
-    return render_template('exams/create.html', categories=categories, courses=courses)
+    return render_template('exams/create.html', categories=categories, courses=courses, availability=availability(),
+                           default_max_exposure=current_app.config['EXAM_MAX_EXPOSURE'])
+
+def _build_job(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or job.kind != EXAM_BUILD:
+        abort(404)
+    return job
+
+@bp.route('/build/<int:job_id>')
+@login_required
+def build_status(job_id):
+    """Progress of a background exam build, polled by the exam list."""
+    job = _build_job(job_id)
+    result = job.get_result() or {}
+    return jsonify({
+        'status': job.status,
+        'position': queue_position(job),
+        'progress': job.progress,
+        'total': job.total,
+        'exam_id': result.get('exam_id'),
+        'error': job.error
+    })
+
+@bp.route('/build/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_build(job_id):
+    job = _build_job(job_id)
+    title = job.get_payload().get('title')
+    if job.status in FINISHED:
+        # Failed builds stay listed until dismissed
+        db.session.delete(job)
+        db.session.commit()
+    elif job.status == RUNNING:
+        # The worker stops at its next check, unless the exam is already being written
+        request_cancel(job)
+        flash(f'Cancelamento da geração da prova "{title}" solicitado.')
+    else:
+        request_cancel(job)
+        flash(f'Geração da prova "{title}" cancelada.')
+    return redirect(url_for('exams.list_exams'))
 
 @bp.route('/download/<int:exam_id>')
 @login_required
@@ -160,46 +220,29 @@ def download_latex(exam_id):
 @bp.route('/download_pdf/<int:exam_id>')
 @login_required
 def download_pdf(exam_id):
-    import subprocess
-    import tempfile
-    import os
-    
-    latex_content = generate_exam_latex(exam_id)
-    
-    with tempfile.TemporaryDirectory() as temp_dir:
-        tex_file_path = os.path.join(temp_dir, 'exam.tex')
-        with open(tex_file_path, 'w', encoding='utf-8') as f:
-            f.write(latex_content)
-            
-        # Run pdflatex twice to resolve references
-        try:
-            for _ in range(2):
-                result = subprocess.run(
-                    ['pdflatex', '-interaction=nonstopmode', 'exam.tex'],
-                    cwd=temp_dir,
-                    capture_output=True,
-                    text=True
-                )
-                if result.returncode != 0:
-                    raise Exception(f"PDFLaTeX failed: {result.stderr}")
-            
-            pdf_file_path = os.path.join(temp_dir, 'exam.pdf')
-            
-            if os.path.exists(pdf_file_path):
-                with open(pdf_file_path, 'rb') as f:
-                    pdf_content = f.read()
-                    
-                response = make_response(pdf_content)
-                response.headers['Content-Type'] = 'application/pdf'
-                response.headers['Content-Disposition'] = f'attachment; filename=prova_{exam_id}.pdf'
-                return response
-            else:
-                flash('Erro: O arquivo PDF não foi gerado.', 'error')
-                return redirect(url_for('exams.list_exams'))
-                
-        except Exception as e:
-            flash(f'Erro ao gerar PDF: {str(e)}', 'error')
-            return redirect(url_for('exams.list_exams'))
+    documents = generate_version_latex(exam_id)
+    as_zip = request.args.get('format') == 'zip'
+
+    try:
+        # Versions are compiled in parallel, and only when their rendered
+        # document changed (services/pdf_service.py)
+        parts = cached_pdfs([latex_content for _, latex_content in documents])
+        if as_zip:
+            names = [f"prova_{exam_id}_versao_{label}.pdf" for label, _ in documents]
+            key = '-'.join(key for _, key in parts)
+            archive = zip_pdfs(zip(names, (path for path, _ in parts)))
+        else:
+            pdf_path, key = merged_pdf(parts)
+    except Exception as e:
+        flash(f'Erro ao gerar PDF: {str(e)}', 'error')
+        return redirect(url_for('exams.list_exams'))
+
+    if as_zip:
+        return send_file(archive, mimetype='application/zip', as_attachment=True,
+                         download_name=f'prova_{exam_id}.zip', etag=hashlib.sha256(key.encode()).hexdigest(),
+                         conditional=True, max_age=0)
+    return send_file(pdf_path, mimetype='application/pdf', as_attachment=True,
+                     download_name=f'prova_{exam_id}.pdf', etag=key, conditional=True, max_age=0)
 
 @bp.route('/toggle_resolution/<int:exam_id>')
 @login_required
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request
 from models import StudentSubmission, ExamVersion, Exam, db
 from routes.auth import login_required
+from services.omr_service import BLANK, MULTIPLE, REVIEW_CONFIDENCE
 
 bp = Blueprint('grades', __name__, url_prefix='/grades')
 
@@ -15,8 +16,12 @@ def list_grades():
     course_id = request.args.get('course_id', type=int)
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    review = request.args.get('review') == '1'
     
     query = StudentSubmission.query.join(ExamVersion).join(Exam)
+
+    if review:
+        query = query.filter(StudentSubmission.needs_review == True)
     
     if exam_id and exam_id != -1:
         query = query.filter(Exam.id == exam_id)
@@ -51,7 +56,8 @@ def list_grades():
                            selected_exam_id=exam_id,
                            selected_course_id=course_id,
                            selected_start_date=start_date,
-                           selected_end_date=end_date)
+                           selected_end_date=end_date,
+                           selected_review=review)
 
 @bp.route('/<int:submission_id>')
 @login_required
@@ -62,6 +68,9 @@ def view_submission(submission_id):
     
     import json
     detected_answers = json.loads(submission.answers)
+    omr = json.loads(submission.omr_data) if submission.omr_data else {}
+    omr_states = omr.get('states', {})
+    omr_confidence = omr.get('confidence', {})
     
     results = []
     # Get questions ordered by number
@@ -95,7 +104,11 @@ def view_submission(submission_id):
             'correct_answer': eq.correct_option_char,
             'is_correct': is_correct,
             'resolution': question_resolution,
-            'weight': q_weight
+            'weight': q_weight,
+            'omr_state': omr_states.get(str(eq.question_number)),
+            'omr_confidence': omr_confidence.get(str(eq.question_number)),
+            'omr_flag': omr_states.get(str(eq.question_number)) in (BLANK, MULTIPLE)
+                        or omr_confidence.get(str(eq.question_number), 1.0) < REVIEW_CONFIDENCE
         })
         total += 1
         
@@ -125,6 +138,17 @@ def delete_submission(submission_id):
     flash('Nota deletada com sucesso. O aluno pode enviar o gabarito novamente.', 'success')
     return redirect(url_for('grades.list_grades', exam_id=exam_id))
 
+@bp.route('/reviewed/<int:submission_id>', methods=['POST'])
+@login_required
+def mark_reviewed(submission_id):
+    submission = StudentSubmission.query.get_or_404(submission_id)
+    submission.needs_review = False
+    db.session.commit()
+    
+    from flask import flash, redirect, url_for
+    flash('Leitura marcada como revisada.', 'success')
+    return redirect(request.referrer or url_for('grades.list_grades', review=1))
+
 @bp.route('/export_csv/<int:exam_id>')
 @login_required
 def export_csv(exam_id):
@@ -160,3 +184,42 @@ def export_csv(exam_id):
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename=notas_{exam.title.replace(' ', '_')}.csv"}
     )
+
+@bp.route('/batch', methods=['GET', 'POST'])
+@login_required
+def batch_upload():
+    import os
+    import tempfile
+    from flask import flash
+    from services.batch_omr_service import process_batch
+
+    exams = Exam.query.order_by(Exam.id.desc()).all()
+    report = None
+
+    if request.method == 'POST':
+        exam_id = request.form.get('exam_id', type=int)
+        directory = request.form.get('directory', '').strip()
+        file = request.files.get('scans_zip')
+
+        try:
+            if file and file.filename != '':
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    # Keep the extension: a multi-page TIFF is read directly
+                    ext = os.path.splitext(file.filename)[1].lower()
+                    scans_path = os.path.join(temp_dir, 'scans' + (ext if ext in ('.tif', '.tiff') else '.zip'))
+                    file.save(scans_path)
+                    report = process_batch(scans_path, exam_id=exam_id)
+            elif directory:
+                report = process_batch(directory, exam_id=exam_id)
+            else:
+                flash('Envie um arquivo ZIP ou TIFF ou informe um diretório.', 'error')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Erro ao processar lote: {str(e)}', 'error')
+
+        if report:
+            summary = report['summary']
+            flash(f"{summary['saved']} de {summary['total']} gabaritos registrados, "
+                  f"{summary['review']} para revisão ({summary['sheets_per_second']:.1f} folhas/s).", 'success')
+
+    return render_template('grades/batch.html', exams=exams, report=report)
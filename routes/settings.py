@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, make_response
 from models import db, Category, Question
 from routes.auth import login_required
+from services import question_counts
 import json
 import io
 from datetime import datetime
@@ -172,6 +173,8 @@ def upload_db():
                             )
                             db.session.add(q)
                 
+                # The bulk delete above bypasses the per-question count upkeep
+                question_counts.rebuild()
                 db.session.commit()
                 flash('Banco de dados atualizado com sucesso!', 'success')
                 
@@ -241,6 +244,7 @@ def reset_db():
         
         # We do NOT delete the User table to allow login
         
+        question_counts.rebuild()
         db.session.commit()
         
         # Delete uploaded files
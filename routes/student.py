@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
-from models import db, ExamVersion, ExamQuestion, StudentSubmission
-import os
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, abort
+from models import db, ExamVersion, ExamQuestion, StudentSubmission, BackgroundJob
 import json
 from werkzeug.utils import secure_filename
 
-from services.omr_service import process_exam_image
+from services.omr_jobs import read_version_sheet, cached_version_sheet, enqueue_upload, OMR_UPLOAD
+from services.job_queue import QueueFullError, queue_position
+from services.upload_service import save_upload, stored_upload
 
 bp = Blueprint('student', __name__, url_prefix='/student')
 
@@ -14,6 +15,7 @@ def upload_answers(unique_code):
     exam = version.exam
     
     detected_answers = {}
+    omr_states = {}
     
     # Check if submission already exists
     existing_submission = StudentSubmission.query.filter_by(exam_version_id=version.id).first()
@@ -76,36 +78,55 @@ def upload_answers(unique_code):
                                submission=existing_submission)
     
     if request.method == 'POST':
+        image_processed = False
+        omr_job_id = None
+
         # Handle Image Upload
         if 'gabarito_img' in request.files:
             file = request.files['gabarito_img']
             if file.filename != '':
-                filename = secure_filename(f"{unique_code}_{file.filename}")
-                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+                # The OMR decodes the upload from memory; keeping a copy of
+                # the photo is optional and happens off the request path.
+                image_data = file.read()
+                image_processed = True
+                if current_app.config['OMR_KEEP_UPLOADS']:
+                    filename = secure_filename(f"{unique_code}_{file.filename}")
+                    save_upload(image_data, current_app.config['UPLOAD_FOLDER'], filename)
                 
-                # Process Image with OMR
-                try:
-                    # We need to know how many questions to look for
-                    num_questions = len(version.questions)
-                    detected_answers = process_exam_image(filepath, num_questions)
+                # Process Image with OMR (a photo sent again is served from the cache)
+                omr_result = None
+                if current_app.config['OMR_ASYNC']:
+                    omr_result = cached_version_sheet(version, image_data)
+                    if omr_result is None:
+                        # Graded by omr_worker.py; the page polls omr_status
+                        try:
+                            omr_job_id = enqueue_upload(version, image_data).id
+                            flash('Imagem recebida! As respostas serão preenchidas automaticamente em instantes.', 'info')
+                        except QueueFullError:
+                            flash('Muitas imagens aguardando correção automática. Por favor, preencha suas respostas manualmente.', 'warning')
+                else:
+                    try:
+                        omr_result = read_version_sheet(version, image_data)
+                    except Exception as e:
+                        flash(f'Erro ao processar imagem: {str(e)}', 'error')
+
+                if omr_result is not None:
+                    detected_answers = omr_result['answers']
+                    omr_states = omr_result['states']
                     
                     if detected_answers:
                         flash('Respostas identificadas! Por favor, verifique e confirme abaixo.', 'success')
                     else:
                         flash('Não foi possível identificar as respostas na imagem. Por favor, preencha manualmente.', 'warning')
-                        
-                except Exception as e:
-                    flash(f'Erro ao processar imagem: {str(e)}', 'error')
         
         # Handle Header Image Upload
         header_filename = None
+        header_write = None
         if 'header_image' in request.files:
             h_file = request.files['header_image']
             if h_file.filename != '':
                 header_filename = secure_filename(f"header_{unique_code}_{h_file.filename}")
-                h_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], header_filename)
-                h_file.save(h_filepath)
+                header_write = save_upload(h_file.read(), current_app.config['UPLOAD_FOLDER'], header_filename)
         
         # If we already have one from previous step (hidden field)
         if not header_filename and request.form.get('uploaded_header_filename'):
@@ -121,6 +142,9 @@ def upload_answers(unique_code):
                                     version=version, 
                                     questions=questions, 
                                     detected_answers=detected_answers, 
+                                    omr_states=omr_states,
+                                    image_processed=image_processed,
+                                    omr_job_id=omr_job_id,
                                     uploaded_filename=filename if 'filename' in locals() else None,
                                     uploaded_header_filename=header_filename)
 
@@ -183,6 +207,7 @@ def upload_answers(unique_code):
                                            version=version, 
                                            questions=questions, 
                                            detected_answers=answers_dict, 
+                                           image_processed=True,
                                            uploaded_filename=request.form.get('uploaded_filename'),
                                            uploaded_header_filename=header_filename)
 
@@ -190,8 +215,9 @@ def upload_answers(unique_code):
                     exam_version_id=version.id,
                     student_name=student_name,
                     student_course=student_course,
-                    image_path=request.form.get('uploaded_filename'),
-                    header_image_path=header_filename,
+                    # Uploads are written in the background: only files that made it to disk
+                    image_path=stored_upload(current_app.config['UPLOAD_FOLDER'], request.form.get('uploaded_filename')),
+                    header_image_path=stored_upload(current_app.config['UPLOAD_FOLDER'], header_filename, header_write),
                     answers=json.dumps(answers_dict),
                     score=final_grade,
                     total_questions=total
@@ -217,3 +243,18 @@ def upload_answers(unique_code):
 
     questions = sorted(version.questions, key=lambda x: x.question_number)
     return render_template('student/upload.html', exam=exam, version=version, questions=questions)
+
+@bp.route('/<unique_code>/omr/<int:job_id>')
+def omr_status(unique_code, job_id):
+    """Status of a queued OMR upload, polled by the upload page."""
+    version = ExamVersion.query.filter_by(unique_code=unique_code).first_or_404()
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or job.kind != OMR_UPLOAD or job.get_payload().get('version_id') != version.id:
+        abort(404)
+
+    return jsonify({
+        'status': job.status,
+        'position': queue_position(job),
+        'result': job.get_result(),
+        'error': job.error
+    })
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from models import db, Exam, ExamVersion, ExamQuestion, Question, StudentSubmission
+from services.omr_service import load_image, count_pages, decode_qr_code, read_sheet, UNIQUE_CODE_RE
+from services import omr_trace
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# Sheets submitted to the pool ahead of the ones being stored, per worker.
+# Bounds the memory held by pending results (and TIFF pages) however
+# large the batch is.
+PREFETCH_PER_WORKER = 2
+
+# Pages of multi-page files are stored as JPEG (browsers do not show TIFF)
+PAGE_JPEG_QUALITY = 90
+
+# unique_code -> (alternatives of each question, layout), installed in every worker process
+_worker_index = {}
+# load_image keyword arguments (decode reduction)
+_decode_options = {}
+
+
+def _init_worker(sheets_by_code, decode_options=None, trace_settings=None):
+    global _worker_index, _decode_options
+    _worker_index = sheets_by_code
+    _decode_options = decode_options or {}
+    omr_trace.configure(**(trace_settings or {}))
+    # One process per core already saturates the CPU; stop OpenCV from
+    # spawning its own thread pool inside every worker.
+    cv2.setNumThreads(1)
+
+
+def _process_sheet(path, page, filename_code):
+    """
+    Runs in a worker process. Must only touch picklable, app-free data.
+
+    The version is taken from the QR code printed on the sheet. The unique
+    code in the file name (the student.upload_answers naming convention)
+    is only used when the QR code cannot be read.
+
+    Only the requested page of a multi-page file is decoded; it is sent
+    back JPEG-encoded so the parent can store it without reading the file
+    again.
+    """
+    start = time.perf_counter()
+    code, routed_by, result, error, image_data = None, None, None, None, None
+    trace = omr_trace.new_trace()
+    try:
+        with trace.stage('decode'):
+            img = load_image(path, page=page, **_decode_options)
+        with trace.stage('qr'):
+            code = decode_qr_code(img)
+        routed_by = 'qr'
+        if code not in _worker_index:
+            code, routed_by = filename_code, 'filename'
+
+        if code in _worker_index:
+            alternatives, layout = _worker_index[code]
+            result = read_sheet(img, len(alternatives), alternatives, layout=layout, trace=trace)
+            if page is not None:
+                image_data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, PAGE_JPEG_QUALITY])[1].tobytes()
+        else:
+            code, routed_by = None, None
+            error = 'Versão não identificada'
+    except Exception as e:
+        error = str(e)
+    omr_trace.finish(trace, os.path.basename(path) if page is None else f"{os.path.basename(path)}:{page + 1}")
+    return code, routed_by, result, error, time.perf_counter() - start, image_data
+
+
+def build_version_index(exam_id=None):
+    """
+    Load the answer keys of all versions with a single query.
+
+    Returns:
+        dict: unique_code -> {'version_id', 'label', 'max_grade', 'course',
+              'answer_key': {question_number: char}, 'weights': {question_number: float},
+              'alternatives': {question_number: int}, 'layout': dict or None}
+    """
+    query = db.session.query(
+        ExamVersion.unique_code, ExamVersion.id, ExamVersion.label, ExamVersion.layout, Exam.max_grade, Exam.course,
+        ExamQuestion.question_number, ExamQuestion.correct_option_char, Question.weight,
+        Question.num_alternatives
+    ).join(Exam, ExamVersion.exam_id == Exam.id) \
+     .join(ExamQuestion, ExamQuestion.version_id == ExamVersion.id) \
+     .outerjoin(Question, ExamQuestion.question_id == Question.id)
+
+    if exam_id:
+        query = query.filter(ExamVersion.exam_id == exam_id)
+
+    index = {}
+    for code, version_id, label, layout, max_grade, course, number, correct, weight, num_alternatives in query:
+        entry = index.get(code)
+        if entry is None:
+            entry = index[code] = {
+                'version_id': version_id,
+                'label': label,
+                'max_grade': max_grade if max_grade else 10.0,
+                'course': course or '',
+                'answer_key': {},
+                'weights': {},
+                'alternatives': {},
+                'layout': json.loads(layout) if layout else None
+            }
+        entry['answer_key'][number] = correct
+        entry['weights'][number] = weight if weight is not None else 1.0
+        entry['alternatives'][number] = num_alternatives or 4
+    return index
+
+
+def collect_scans(source, work_dir):
+    """
+    List the images of a batch.
+
+    Args:
+        source (str): A directory, a ZIP file or a single (multi-page) image
+            with the scanned sheets.
+        work_dir (str): Scratch directory where ZIP members are extracted.
+
+    Returns:
+        list: (name, path) tuples sorted by name.
+    """
+    scans = []
+
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    scans.append((name, os.path.join(root, name)))
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for member in zf.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(work_dir, f"{len(scans)}_{secure_filename(name)}")
+                with zf.open(member) as src, open(path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                scans.append((name, path))
+    elif os.path.isfile(source) and source.lower().endswith(IMAGE_EXTENSIONS):
+        scans.append((os.path.basename(source), source))
+    else:
+        raise ValueError("A origem deve ser um diretório, um arquivo ZIP ou uma imagem.")
+
+    return sorted(scans)
+
+
+def expand_pages(scans):
+    """
+    One item per sheet: the pages of multi-page TIFF files (document
+    feeder stacks) become separate sheets named <file>-p<page>.
+
+    Returns:
+        list: (name, path, page) tuples, page None for single-image files.
+    """
+    sheets = []
+    for name, path in scans:
+        pages = count_pages(path)
+        if pages > 1:
+            stem, ext = os.path.splitext(name)
+            sheets.extend((f"{stem}-p{page + 1:03d}{ext}", path, page) for page in range(pages))
+        else:
+            sheets.append((name, path, None))
+    return sheets
+
+
+def _grade(entry, answers):
+    # Same weighted grading as student.upload_answers
+    total_weight = 0.0
+    earned_weight = 0.0
+    score = 0
+
+    for number, correct in entry['answer_key'].items():
+        q_weight = entry['weights'][number]
+        total_weight += q_weight
+        if answers.get(number) == correct:
+            score += 1
+            earned_weight += q_weight
+
+    final_grade = (earned_weight / total_weight) * entry['max_grade'] if total_weight > 0 else 0
+    return score, final_grade
+
+
+def process_batch(source, exam_id=None, workers=None, commit_size=None):
+    """
+    Grade a whole folder (or ZIP) of answer sheets in parallel.
+
+    Each sheet is routed to its version by the printed QR code, graded by
+    the OMR in a process pool and stored as a StudentSubmission. Multi-page
+    TIFF files (document feeder stacks) are split into one sheet per page;
+    the workers decode a single page each, so memory does not grow with the
+    size of the stack. Sheets
+    with a low-confidence read (blank, double or erased marks) are stored
+    with needs_review set, the others are accepted as they are.
+    Submissions are committed in batches of `commit_size` rows. Scans of
+    different exams can be mixed in the same batch.
+
+    Args:
+        source (str): Directory or ZIP file with the scans.
+        exam_id (int): Restrict routing to versions of this exam.
+        workers (int): Pool size. Defaults to OMR_WORKERS.
+        commit_size (int): Rows per commit. Defaults to OMR_BATCH_COMMIT_SIZE.
+
+    Returns:
+        dict: {'sheets': [per-sheet result], 'summary': {...}}
+    """
+    workers = workers or current_app.config['OMR_WORKERS']
+    commit_size = commit_size or current_app.config['OMR_BATCH_COMMIT_SIZE']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+
+    start = time.perf_counter()
+    sheets = []
+    pending = 0
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        scans = collect_scans(source, work_dir)
+
+        index = build_version_index(exam_id)
+        sheets_by_code = {
+            code: ([entry['alternatives'][number] for number in sorted(entry['alternatives'])], entry['layout'])
+            for code, entry in index.items()
+        }
+
+        # Versions that already have a submission are not graded again
+        # (one submission per QR code, as in upload_answers).
+        used_version_ids = {
+            row.exam_version_id for row in
+            db.session.query(StudentSubmission.exam_version_id).distinct()
+        }
+
+        decode_options = {'reduce': current_app.config['OMR_DECODE_REDUCTION'],
+                          'min_side': current_app.config['OMR_DECODE_MIN_SIDE']}
+
+        def store(future):
+            nonlocal pending
+            sheet, path, page = futures.pop(future)
+            code, routed_by, result, error, seconds, image_data = future.result()
+            sheet['seconds'] = seconds
+
+            if error:
+                sheet['message'] = error
+                return
+
+            entry = index[code]
+            sheet.update(unique_code=code, version_label=entry['label'], routed_by=routed_by)
+
+            if entry['version_id'] in used_version_ids:
+                sheet['status'] = 'skipped'
+                sheet['message'] = 'Versão já possui envio'
+                return
+
+            answers = result['answers']
+            score, final_grade = _grade(entry, answers)
+            sheet.update(status='saved', answers=answers, score=final_grade,
+                         needs_review=result['needs_review'], min_confidence=result['min_confidence'])
+
+            if page is None:
+                filename = secure_filename(f"{code}_{sheet['name']}")
+                shutil.copyfile(path, os.path.join(upload_folder, filename))
+            else:
+                filename = secure_filename(f"{code}_{os.path.splitext(sheet['name'])[0]}.jpg")
+                with open(os.path.join(upload_folder, filename), 'wb') as f:
+                    f.write(image_data)
+
+            db.session.add(StudentSubmission(
+                exam_version_id=entry['version_id'],
+                student_name=os.path.splitext(sheet['name'])[0],
+                student_course=entry['course'],
+                image_path=filename,
+                answers=json.dumps(answers),
+                omr_data=json.dumps({k: result[k] for k in ('states', 'confidence', 'fill')}),
+                needs_review=result['needs_review'],
+                score=final_grade,
+                total_questions=len(entry['answer_key'])
+            ))
+            used_version_ids.add(entry['version_id'])
+
+            pending += 1
+            if pending >= commit_size:
+                db.session.commit()
+                pending = 0
+
+        # Decode -> OMR runs in the pool while finished sheets are stored
+        # here; at most max_in_flight sheets are pending at any time.
+        max_in_flight = workers * PREFETCH_PER_WORKER
+        futures = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(sheets_by_code, decode_options, omr_trace.settings())) as pool:
+            for name, path, page in expand_pages(scans):
+                while len(futures) >= max_in_flight:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        store(future)
+
+                sheet = {'name': name, 'status': 'error', 'answers': {}, 'score': None, 'message': '', 'seconds': 0.0,
+                         'needs_review': False, 'min_confidence': None}
+                sheets.append(sheet)
+
+                match = UNIQUE_CODE_RE.search(name.lower())
+                future = pool.submit(_process_sheet, path, page, match.group(0) if match else None)
+                futures[future] = (sheet, path, page)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(future)
+
+        if pending:
+            db.session.commit()
+
+    elapsed = time.perf_counter() - start
+    processed = [s for s in sheets if s['seconds']]
+    summary = {
+        'total': len(sheets),
+        'saved': sum(1 for s in sheets if s['status'] == 'saved'),
+        'auto_accepted': sum(1 for s in sheets if s['status'] == 'saved' and not s['needs_review']),
+        'review': sum(1 for s in sheets if s['status'] == 'saved' and s['needs_review']),
+        'skipped': sum(1 for s in sheets if s['status'] == 'skipped'),
+        'errors': sum(1 for s in sheets if s['status'] == 'error'),
+        'workers': workers,
+        'elapsed': elapsed,
+        'sheets_per_second': len(processed) / elapsed if elapsed > 0 else 0.0,
+        'avg_sheet_seconds': sum(s['seconds'] for s in processed) / len(processed) if processed else 0.0,
+    }
+
+    return {'sheets': sheets, 'summary': summary}
@@ -0,0 +1,47 @@
+import time
+
+from models import BackgroundJob
+from services import job_queue
+from services.exam_service import create_exam_logic
+
+EXAM_BUILD = 'exam_build'
+
+# Seconds between two progress commits of a running build
+PROGRESS_INTERVAL = 0.5
+
+# Builds shown on the exam list: running, waiting, or failed (until purged by the worker)
+LISTED_STATUSES = (job_queue.PENDING, job_queue.RUNNING, job_queue.ERROR)
+
+
+def enqueue_exam_build(params):
+    """
+    Queue the generation of an exam for omr_worker.py.
+
+    Args:
+        params (dict): create_exam_logic keyword arguments (JSON-serializable).
+    """
+    return job_queue.enqueue(EXAM_BUILD, params)
+
+
+def listed_builds():
+    return BackgroundJob.query.filter(BackgroundJob.kind == EXAM_BUILD, BackgroundJob.status.in_(LISTED_STATUSES)) \
+        .order_by(BackgroundJob.id.desc()).all()
+
+
+@job_queue.register(EXAM_BUILD)
+def build_exam(job):
+    last_update = 0.0
+
+    def progress(done, total):
+        # Versions are planned in memory before anything is written, so
+        # cancelling here leaves nothing behind
+        nonlocal last_update
+        now = time.monotonic()
+        if done < total and now - last_update < PROGRESS_INTERVAL:
+            return
+        last_update = now
+        job_queue.check_cancelled(job)
+        job_queue.update_progress(job, done, total)
+
+    exam = create_exam_logic(**job.get_payload(), progress=progress)
+    return {'exam_id': exam.id}
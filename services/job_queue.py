@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, func
+
+from models import db, BackgroundJob
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, ERROR, CANCELLED)
+
+# kind -> handler(job) returning a JSON-serializable result
+HANDLERS = {}
+
+
+class QueueFullError(Exception):
+    """Raised by enqueue when the queue already holds max_pending jobs."""
+
+
+class JobCancelled(Exception):
+    """Raised by handlers (via check_cancelled) to stop a job early."""
+
+
+def register(kind):
+    """Decorator registering the handler of a job kind."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, blob=None, max_pending=None):
+    """
+    Add a job to the queue and commit it.
+
+    Args:
+        kind (str): Registered handler name.
+        payload (dict): JSON arguments of the handler.
+        blob (bytes): Optional binary input.
+        max_pending (int): Refuse the job when this many jobs are already pending.
+
+    Returns:
+        BackgroundJob: The queued job.
+    """
+    if max_pending is not None and pending_count() >= max_pending:
+        raise QueueFullError(f"{max_pending} jobs already pending")
+
+    job = BackgroundJob(kind=kind, payload=json.dumps(payload or {}), blob=blob)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def pending_count(kind=None):
+    query = BackgroundJob.query.filter_by(status=PENDING)
+    if kind:
+        query = query.filter_by(kind=kind)
+    return query.count()
+
+
+def queue_position(job):
+    """Number of pending jobs ahead of this one (0 when it is next or already running)."""
+    if job.status != PENDING:
+        return 0
+    return BackgroundJob.query.filter(BackgroundJob.status == PENDING, BackgroundJob.id < job.id).count()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next(worker, kinds=None):
+    """
+    Atomically take the oldest pending job.
+
+    The conditional UPDATE only succeeds for one worker when several race
+    for the same row, so no locking beyond SQLite's own is needed.
+
+    Returns:
+        BackgroundJob or None
+    """
+    kinds = list(kinds or HANDLERS)
+    while True:
+        candidate = db.session.query(BackgroundJob.id) \
+            .filter(BackgroundJob.status == PENDING, BackgroundJob.kind.in_(kinds)) \
+            .order_by(BackgroundJob.id).first()
+        if candidate is None:
+            db.session.rollback()
+            return None
+
+        claimed = db.session.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == candidate.id, BackgroundJob.status == PENDING)
+            .values(status=RUNNING, worker=worker, started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(BackgroundJob, candidate.id)
+
+
+def run_job(job):
+    """Run the handler of a claimed job and store its outcome."""
+    try:
+        result = HANDLERS[job.kind](job)
+        job.status = DONE
+        job.result = json.dumps(result)
+    except JobCancelled:
+        db.session.rollback()
+        job.status = CANCELLED
+    except Exception as e:
+        db.session.rollback()
+        job.status = ERROR
+        job.error = str(e)
+
+    job.blob = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def update_progress(job, progress, total=None):
+    """Store the progress of a running job (committed so pollers can see it)."""
+    job.progress = progress
+    if total is not None:
+        job.total = total
+    db.session.commit()
+
+
+def check_cancelled(job):
+    """Raise JobCancelled when cancellation of the job was requested."""
+    cancel_requested = db.session.query(BackgroundJob.cancel_requested).filter_by(id=job.id).scalar()
+    if cancel_requested:
+        raise JobCancelled()
+
+
+def request_cancel(job):
+    """Cancel a pending job now, or ask its handler to stop if already running."""
+    if job.status == PENDING:
+        job.status = CANCELLED
+        job.blob = None
+        job.finished_at = datetime.utcnow()
+    elif job.status == RUNNING:
+        job.cancel_requested = True
+    db.session.commit()
+
+
+def requeue_stale(max_age_seconds):
+    """Put back jobs left running by a worker that died. Returns how many."""
+    limit = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    count = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.status == RUNNING, BackgroundJob.started_at < limit)
+        .values(status=PENDING, worker=None, started_at=None)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def purge_finished(max_age_seconds):
+    """Delete finished jobs older than max_age_seconds. Returns how many."""
+    limit = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    count = BackgroundJob.query.filter(
+        BackgroundJob.status.in_(FINISHED), BackgroundJob.finished_at < limit
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def work(kinds=None, poll_interval=0.5, until_empty=False):
+    """
+    Worker loop: claim and run jobs, sleeping poll_interval seconds whenever
+    the queue is empty. Runs forever unless until_empty is set.
+
+    Returns:
+        int: Number of jobs run.
+    """
+    name = worker_name()
+    done = 0
+    while True:
+        job = claim_next(name, kinds)
+        if job is None:
+            if until_empty:
+                return done
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        db.session.remove()
+        done += 1
+
+
+def status_counts():
+    """Jobs per status, e.g. {'pending': 3, 'running': 2}."""
+    rows = db.session.query(BackgroundJob.status, func.count(BackgroundJob.id)).group_by(BackgroundJob.status)
+    return {status: count for status, count in rows}
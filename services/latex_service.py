@@ -1,58 +1,155 @@
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from flask import url_for
 from jinja2 import Environment, FileSystemLoader
-from models import Exam
+from sqlalchemy.orm import selectinload
+from models import db, Exam, ExamVersion, ExamQuestion
+from services.qr_service import qr_matrix
+from services.layout_service import ensure_version_layout, marker_bits, OPTIONS
 
 import re
 
+# Matrix environments written without math mode: \begin{env}...\end{env}
+# NOT already inside $ or \[ (a simple heuristic, a full parser is complex)
+MATH_ENV_RE = re.compile(
+    r'(?<!\$)(?<!\\\[)(\\begin\{(pmatrix|bmatrix|vmatrix|matrix|smallmatrix)\}.*?\\end\{\2\})(?!\$)(?!\\\])',
+    re.DOTALL
+)
+
+# Sanitized statement and alternatives of the questions printed recently,
+# by question id and content: a question shared by many versions (or
+# exams) is only processed once
+FRAGMENT_CACHE_SIZE = 2048
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'latex_templates')
+
+# Setup Jinja2 for LaTeX
+# We use different delimiters to avoid conflict with LaTeX syntax
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    block_start_string='\\BLOCK{',
+    block_end_string='}',
+    variable_start_string='\\VAR{',
+    variable_end_string='}',
+    comment_start_string='\\#{',
+    comment_end_string='}',
+    line_statement_prefix='%%',
+    line_comment_prefix='%#',
+    trim_blocks=True,
+    autoescape=False,
+)
+
 def sanitize_latex(text):
     if not text:
         return ""
     
-    # List of math environments that need to be in math mode
-    math_envs = ['pmatrix', 'bmatrix', 'vmatrix', 'matrix', 'smallmatrix']
-    
-    for env in math_envs:
-        # Pattern to find \begin{env}...\end{env} NOT already inside $ or \[
-        # This is a simple heuristic. A full parser is complex.
-        # We just check if it looks like it's naked in the text.
-        
-        # We replace \begin{env} with \[\begin{env} and \end{env} with \end{env}\]
-        # BUT only if we don't see a $ right before it.
-        # Actually, let's just use a regex that looks for the block.
-        
-        pattern = r'(?<!\$)(?<!\\\[)(\\begin\{' + env + r'\}.*?\\end\{' + env + r'\})(?!\$)(?!\\\])'
-        
-        # Using a callback to wrap it
-        text = re.sub(pattern, r'\\[ \1 \\]', text, flags=re.DOTALL)
-        
-    return text
+    # Wrap naked matrix environments in \[ ... \]
+    return MATH_ENV_RE.sub(r'\\[ \1 \\]', text)
 
-def generate_exam_latex(exam_id):
-    exam = Exam.query.get_or_404(exam_id)
-    
-    # Setup Jinja2 for LaTeX
-    # We use different delimiters to avoid conflict with LaTeX syntax
-    env = Environment(
-        loader=FileSystemLoader(os.path.join(os.getcwd(), 'latex_templates')),
-        block_start_string='\\BLOCK{',
-        block_end_string='}',
-        variable_start_string='\\VAR{',
-        variable_end_string='}',
-        comment_start_string='\\#{',
-        comment_end_string='}',
-        line_statement_prefix='%%',
-        line_comment_prefix='%#',
-        trim_blocks=True,
-        autoescape=False,
-    )
-    
-    template = env.get_template('exam_template.tex')
-    
+def _question_fragments(q):
+    """Sanitized statement and alternatives (by original letter) of a question, cached."""
+    original_map = {
+        'A': q.alt_a, 
+        'B': q.alt_b, 
+        'C': q.alt_c, 
+        'D': q.alt_d,
+        'E': q.alt_e if hasattr(q, 'alt_e') else ''
+    }
+    content = '\0'.join([q.statement or ''] + [alt or '' for alt in original_map.values()])
+    key = (q.id, hashlib.sha1(content.encode('utf-8')).digest())
+
+    with _fragments_lock:
+        fragments = _fragments.get(key)
+        if fragments is not None:
+            _fragments.move_to_end(key)
+            return fragments
+
+    fragments = (sanitize_latex(q.statement), {k: sanitize_latex(alt) for k, alt in original_map.items()})
+    with _fragments_lock:
+        _fragments[key] = fragments
+        if len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return fragments
+
+def _fill_bits(bits, x, y, module):
+    # One \fill per horizontal run of black modules
+    commands = []
+    for r, row in enumerate(bits):
+        c = 0
+        while c < len(row):
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < len(row) and row[c]:
+                c += 1
+            commands.append(f"\\fill ({x + start * module:.3f},{y + r * module:.3f}) "
+                            f"rectangle ({x + c * module:.3f},{y + (r + 1) * module:.3f});")
+    return commands
+
+def answer_grid_tikz(layout):
+    """
+    Draw the answer grid of a version as a TikZ picture in mm units, placing
+    the ArUco markers and bubbles exactly where the layout (and therefore
+    the OMR) expects them.
+    """
+    lines = ['\\begin{tikzpicture}[x=1mm, y=-1mm, font=\\footnotesize]']
+
+    size = layout['marker_size']
+    for marker_id, (x, y) in layout['markers'].items():
+        bits = marker_bits(int(marker_id), layout['dictionary'])
+        lines.extend(_fill_bits(bits, x, y, size / len(bits)))
+
+    for block in layout['headers']:
+        for a, (x, y) in enumerate(block):
+            lines.append(f"\\node at ({x},{y}) {{{OPTIONS[a]}}};")
+
+    radius = layout['bubble_radius']
+    for idx, (cells, (nx, ny)) in enumerate(zip(layout['cells'], layout['numbers'])):
+        lines.append(f"\\node at ({nx},{ny}) {{\\textbf{{{idx + 1}}}}};")
+        for x, y in cells:
+            lines.append(f"\\draw[line width=0.3pt] ({x},{y}) circle ({radius});")
+
+    lines.append('\\end{tikzpicture}')
+    return '\n'.join(lines)
+
+# Choosing the QR mask is most of the rendering time; a version's QR never
+# changes. Each picture is ~17 KB: the bound covers re-rendering a large
+# exam, not every version ever printed.
+QR_CACHE_SIZE = 256
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_code_tikz(data, width=40):
+    """
+    Draw the QR code of `data` as a TikZ picture `width` mm wide, so the
+    PDF needs no image files.
+    """
+    matrix = qr_matrix(data)
+    module = width / len(matrix)
+    lines = ['\\begin{tikzpicture}[x=1mm, y=-1mm]']
+    # The quiet zone is white: keep it in the bounding box
+    lines.append(f"\\path (0,0) rectangle ({width},{width});")
+    lines.extend(_fill_bits(matrix, 0, 0, module))
+    lines.append('\\end{tikzpicture}')
+    return '\n'.join(lines)
+
+def _template():
+    # Compiled once; Jinja reloads it if the file changes
+    return _env.get_template('exam_template.tex')
+
+def _versions_data(exam):
     # Prepare data structure for template
     # We need to resolve the shuffled alternatives for the template
     versions_data = []
-    for version in exam.versions:
+    # Questions of all versions in two queries, instead of two per version
+    versions = ExamVersion.query.filter_by(exam_id=exam.id).order_by(ExamVersion.id) \
+        .options(selectinload(ExamVersion.questions).selectinload(ExamQuestion.question)).all()
+    for version in versions:
         questions_data = []
         for eq in version.questions:
             q = eq.question
@@ -66,39 +163,54 @@ def generate_exam_latex(exam_id):
                 })
                 continue
 
-            order = eq.get_alternatives_order() # e.g. ['C', 'A', 'D', 'B']
+            order = eq.get_alternatives_order() # e.g. ('C', 'A', 'D', 'B')
+            statement, original_alts = _question_fragments(q)
             
             # Map new positions to content
             # Position A (index 0) gets content of original key order[0]
-            alts = []
-            original_map = {
-                'A': q.alt_a, 
-                'B': q.alt_b, 
-                'C': q.alt_c, 
-                'D': q.alt_d,
-                'E': q.alt_e if hasattr(q, 'alt_e') else ''
-            }
-            
-            for key in order:
-                content = original_map.get(key, '')
-                alts.append(sanitize_latex(content))
+            alts = [original_alts.get(key, '') for key in order]
                 
             questions_data.append({
                 'number': eq.question_number,
-                'statement': sanitize_latex(q.statement),
+                'statement': statement,
                 'alts': alts, # List of strings [content_of_pos_A, content_of_pos_B...]
                 'weight': q.weight if q.weight else 1.0
             })
             
+        # The grid geometry is stored so the OMR reads exactly what was printed
+        layout = ensure_version_layout(version)
+
+        qr_url = url_for('student.upload_answers', unique_code=version.unique_code, _external=True)
         versions_data.append({
             'label': version.label,
-            'qr_code': f"{version.unique_code}.png",
-            'qr_url': url_for('student.upload_answers', unique_code=version.unique_code, _external=True),
+            'answer_grid': answer_grid_tikz(layout),
+            'qr_code': qr_code_tikz(qr_url),
+            'qr_url': qr_url,
             'questions': questions_data
         })
         
-    return template.render(
+    # Persist layouts computed for versions printed for the first time
+    if db.session.dirty:
+        db.session.commit()
+
+    return versions_data
+
+def generate_exam_latex(exam_id):
+    exam = Exam.query.get_or_404(exam_id)
+    return _template().render(
         exam=exam,
-        versions=versions_data,
-        cwd=os.getcwd().replace('\\', '/') # Fix paths for LaTeX
+        versions=_versions_data(exam)
     )
+
+def generate_version_latex(exam_id):
+    """
+    One standalone document per version, so the versions can be compiled
+    (and cached) independently.
+
+    Returns:
+        list: (version label, LaTeX source) tuples, in version order.
+    """
+    exam = Exam.query.get_or_404(exam_id)
+    template = _template()
+    return [(version['label'], template.render(exam=exam, versions=[version]))
+            for version in _versions_data(exam)]
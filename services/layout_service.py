@@ -0,0 +1,133 @@
+import json
+import math
+import cv2
+
+# Answer grid printed by generate_exam_latex. All measures are in mm, with
+# the origin at the top-left corner of the top-left marker and y growing
+# downwards. The OMR maps the four ArUco markers to these coordinates, so
+# the geometry stored with a version must never change once printed: bump
+# LAYOUT_VERSION instead.
+LAYOUT_VERSION = 1
+
+ARUCO_DICTIONARY = 'DICT_4X4_50'
+MARKER_IDS = (0, 1, 2, 3)  # top-left, top-right, bottom-right, bottom-left
+MARKER_SIZE = 7.0
+MARKER_GAP = 3.0            # Quiet zone between markers and bubbles
+
+NUMBER_WIDTH = 7.0          # Question number column of each block
+PITCH_X = 6.0               # Distance between alternatives
+PITCH_Y = 6.0               # Distance between questions
+HEADER_HEIGHT = 5.0         # Row with the A-E letters
+BLOCK_GAP = 5.0
+BUBBLE_RADIUS = 2.2
+
+ROWS_PER_BLOCK = 20
+MAX_GRID_WIDTH = 170.0      # A4 text width with 2cm margins
+
+OPTIONS = 'ABCDE'
+
+
+def build_layout(num_alternatives):
+    """
+    Compute the answer grid geometry of a version.
+
+    Questions are laid out top to bottom in blocks of ROWS_PER_BLOCK rows,
+    side by side, using as many blocks as fit in MAX_GRID_WIDTH (longer
+    blocks are used when the exam does not fit).
+
+    Args:
+        num_alternatives (list): Alternatives of each question, in question order.
+
+    Returns:
+        dict: Layout descriptor (JSON serializable) with the page size, the
+        marker positions and the bubble centres of every question.
+    """
+    num_questions = len(num_alternatives)
+    max_alternatives = max(num_alternatives) if num_alternatives else 4
+    border = MARKER_SIZE + MARKER_GAP
+    block_width = NUMBER_WIDTH + max_alternatives * PITCH_X
+
+    max_blocks = max(1, int((MAX_GRID_WIDTH - 2 * border + BLOCK_GAP) // (block_width + BLOCK_GAP)))
+    rows = max(ROWS_PER_BLOCK, math.ceil(num_questions / max_blocks))
+    rows = min(rows, max(num_questions, 1))
+    blocks = max(1, math.ceil(num_questions / rows))
+
+    width = 2 * border + blocks * block_width + (blocks - 1) * BLOCK_GAP
+    height = 2 * border + HEADER_HEIGHT + rows * PITCH_Y
+
+    cells = []
+    numbers = []
+    for idx, alternatives in enumerate(num_alternatives):
+        block, row = divmod(idx, rows)
+        left = border + block * (block_width + BLOCK_GAP)
+        y = border + HEADER_HEIGHT + (row + 0.5) * PITCH_Y
+        numbers.append([round(left + NUMBER_WIDTH / 2, 2), round(y, 2)])
+        cells.append([
+            [round(left + NUMBER_WIDTH + (a + 0.5) * PITCH_X, 2), round(y, 2)]
+            for a in range(alternatives)
+        ])
+
+    headers = []
+    for block in range(blocks):
+        left = border + block * (block_width + BLOCK_GAP)
+        y = border + HEADER_HEIGHT / 2
+        headers.append([
+            [round(left + NUMBER_WIDTH + (a + 0.5) * PITCH_X, 2), round(y, 2)]
+            for a in range(max_alternatives)
+        ])
+
+    return {
+        'version': LAYOUT_VERSION,
+        'dictionary': ARUCO_DICTIONARY,
+        'width': round(width, 2),
+        'height': round(height, 2),
+        'marker_size': MARKER_SIZE,
+        'markers': {
+            str(MARKER_IDS[0]): [0.0, 0.0],
+            str(MARKER_IDS[1]): [round(width - MARKER_SIZE, 2), 0.0],
+            str(MARKER_IDS[2]): [round(width - MARKER_SIZE, 2), round(height - MARKER_SIZE, 2)],
+            str(MARKER_IDS[3]): [0.0, round(height - MARKER_SIZE, 2)],
+        },
+        'bubble_radius': BUBBLE_RADIUS,
+        'alternatives': list(num_alternatives),
+        'cells': cells,
+        'numbers': numbers,
+        'headers': headers,
+    }
+
+
+def version_alternatives(version):
+    questions = sorted(version.questions, key=lambda x: x.question_number)
+    return [eq.question.num_alternatives if eq.question and eq.question.num_alternatives else 4
+            for eq in questions]
+
+
+def ensure_version_layout(version):
+    """
+    Return the layout of a version, computing and storing it the first time
+    the version is printed. The caller commits the session.
+    """
+    if version.layout:
+        return json.loads(version.layout)
+
+    layout = build_layout(version_alternatives(version))
+    version.layout = json.dumps(layout)
+    return layout
+
+
+def load_layout(version):
+    """Layout stored for a version, or None for sheets printed with the old answer table."""
+    return json.loads(version.layout) if version.layout else None
+
+
+def marker_bits(marker_id, dictionary=ARUCO_DICTIONARY):
+    """
+    Bit matrix of an ArUco marker including its black border.
+
+    Returns:
+        list: Rows of booleans, True for black modules.
+    """
+    aruco_dict = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, dictionary))
+    side = aruco_dict.markerSize + 2
+    img = cv2.aruco.generateImageMarker(aruco_dict, marker_id, side)
+    return [[pixel == 0 for pixel in row] for row in img.tolist()]
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Results of the OMR memoized by image content, so a photo uploaded again
+# (after a form error, a page reload...) is not processed twice. Values
+# must be JSON serializable to be stored on disk.
+#
+# The disk tier is bounded too: least recently used files (by mtime, which
+# a disk hit refreshes) are deleted once it outgrows _disk_max_bytes. The
+# directory is only scanned every DISK_EVICT_INTERVAL writes.
+
+DISK_EVICT_INTERVAL = 64
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+_max_entries = 256
+_disk_dir = None
+_disk_max_bytes = 64 * 1024 * 1024
+_disk_writes = 0
+
+
+def configure(max_entries=None, disk_dir=None, disk_max_bytes=None):
+    """Set the memory bound, the optional disk directory (None disables it) and its size bound."""
+    global _max_entries, _disk_dir, _disk_max_bytes
+    if max_entries is not None:
+        _max_entries = max_entries
+    if disk_max_bytes is not None:
+        _disk_max_bytes = disk_max_bytes
+    _disk_dir = disk_dir
+    if disk_dir:
+        os.makedirs(disk_dir, exist_ok=True)
+
+
+def make_key(data, *parts):
+    """
+    Cache key of an image.
+
+    Args:
+        data (bytes): Encoded image.
+        parts: Anything else the result depends on (version, layout, decode options).
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    context = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{digest}-{context}"
+
+
+def _disk_path(key):
+    return os.path.join(_disk_dir, key[:2], f"{key}.json")
+
+
+def get(key):
+    """Cached value, or None. Callers must not modify the returned value."""
+    with _lock:
+        value = _entries.get(key)
+        if value is not None:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return value
+
+    if _disk_dir:
+        path = _disk_path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            # The modification time orders the LRU eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            value = None
+        if value is not None:
+            with _lock:
+                _stats['disk_hits'] += 1
+            _remember(key, value)
+            return value
+
+    with _lock:
+        _stats['misses'] += 1
+    return None
+
+
+def _remember(key, value):
+    with _lock:
+        _entries[key] = value
+        _entries.move_to_end(key)
+        while len(_entries) > _max_entries:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def put(key, value):
+    global _disk_writes
+    _remember(key, value)
+
+    if _disk_dir:
+        path = _disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+        with _lock:
+            _disk_writes += 1
+            due = _disk_writes % DISK_EVICT_INTERVAL == 0
+        if due:
+            evict_disk(_disk_max_bytes)
+
+
+def evict_disk(max_bytes):
+    """Delete the least recently used disk entries until they fit in max_bytes. Returns how many."""
+    if not _disk_dir:
+        return 0
+    entries = []
+    for sub in os.scandir(_disk_dir):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    with _lock:
+        _stats['disk_evictions'] += removed
+    return removed
+
+
+def stats():
+    """Counters since start: hits (memory), disk_hits, misses, evictions (memory), disk_evictions, size, hit_ratio."""
+    with _lock:
+        result = dict(_stats, size=len(_entries), max_entries=_max_entries)
+    lookups = result['hits'] + result['disk_hits'] + result['misses']
+    result['hit_ratio'] = (result['hits'] + result['disk_hits']) / lookups if lookups else 0.0
+    return result
+
+
+def clear():
+    """Empty the memory cache and reset the counters (disk entries are kept)."""
+    with _lock:
+        _entries.clear()
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,82 @@
+from flask import current_app
+
+from models import db, ExamVersion
+from services import job_queue, omr_cache
+from services.omr_service import load_image, read_sheet
+from services.omr_trace import new_trace, finish
+from services.layout_service import load_layout, version_alternatives
+
+OMR_UPLOAD = 'omr_upload'
+
+# Bump when a change to the OMR alters its results, to ignore old disk cache entries
+CACHE_FORMAT = 1
+
+# Fields of read_sheet kept in the job result
+RESULT_FIELDS = ('answers', 'states', 'confidence', 'min_confidence', 'needs_review', 'located')
+
+
+def _sheet_cache_key(version, image_data, alternatives):
+    # Everything the result depends on besides the pixels
+    return omr_cache.make_key(image_data, CACHE_FORMAT, version.unique_code, version.layout, alternatives,
+                              current_app.config['OMR_DECODE_REDUCTION'], current_app.config['OMR_DECODE_MIN_SIDE'])
+
+
+def _to_cache(result):
+    # JSON form: question numbers as strings
+    return {field: {str(k): v for k, v in value.items()} if isinstance(value, dict) else value
+            for field, value in result.items()}
+
+
+def _from_cache(value):
+    return {field: {int(k): v for k, v in data.items()} if isinstance(data, dict) else data
+            for field, data in value.items()}
+
+
+def cached_version_sheet(version, image_data):
+    """read_version_sheet result of an image already seen, or None."""
+    value = omr_cache.get(_sheet_cache_key(version, image_data, version_alternatives(version)))
+    return _from_cache(value) if value is not None else None
+
+
+def read_version_sheet(version, image_data):
+    """
+    Run the OMR on an uploaded photo of a version's answer sheet. Results
+    are memoized by image content (see services/omr_cache.py).
+
+    Args:
+        version (ExamVersion): Version the sheet belongs to.
+        image_data (bytes): Encoded image, as uploaded.
+
+    Returns:
+        dict: read_sheet result.
+    """
+    alternatives = version_alternatives(version)
+    key = _sheet_cache_key(version, image_data, alternatives)
+    cached = omr_cache.get(key)
+    if cached is not None:
+        return _from_cache(cached)
+
+    trace = new_trace()
+    with trace.stage('decode'):
+        img = load_image(memoryview(image_data),
+                         reduce=current_app.config['OMR_DECODE_REDUCTION'],
+                         min_side=current_app.config['OMR_DECODE_MIN_SIDE'])
+    result = read_sheet(img, len(alternatives), alternatives, layout=load_layout(version), trace=trace)
+    finish(trace, version.unique_code)
+    omr_cache.put(key, _to_cache(result))
+    return result
+
+
+def enqueue_upload(version, image_data):
+    """Queue an uploaded sheet for omr_worker.py. Raises job_queue.QueueFullError."""
+    return job_queue.enqueue(OMR_UPLOAD, {'version_id': version.id}, blob=image_data,
+                             max_pending=current_app.config['OMR_QUEUE_MAX_PENDING'])
+
+
+@job_queue.register(OMR_UPLOAD)
+def grade_upload(job):
+    version = db.session.get(ExamVersion, job.get_payload()['version_id'])
+    if version is None:
+        raise ValueError('Versão não encontrada')
+    result = read_version_sheet(version, job.blob)
+    return {field: result[field] for field in RESULT_FIELDS}
@@ -1,38 +1,364 @@
+import re
+import heapq
 import cv2
 import numpy as np
 
-def process_exam_image(image_path, num_questions):
+from services.omr_trace import SheetTrace, new_trace, finish
+
+# QR codes are located on a downscaled copy of the photo; the detector only
+# needs a few pixels per module and full-resolution phone photos are slow.
+QR_DETECT_MAX_SIDE = 1000
+
+# The QR encodes the upload URL (.../student/<unique_code>)
+UNIQUE_CODE_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+OPTIONS = 'ABCDE'
+
+# Files that may hold several sheets (document feeder scans)
+MULTIPAGE_EXTENSIONS = ('.tif', '.tiff')
+
+# Columns A-E printed in the answer table of exam_template.tex
+SHEET_ALTERNATIVES = 5
+
+# Table detection runs on a pyramid level at most 1/4 of the photo size,
+# keeping the shorter side above TABLE_DETECT_MIN_SIDE pixels
+TABLE_DETECT_LEVELS = 2
+TABLE_DETECT_MIN_SIDE = 500
+
+# Minimum fraction of dark pixels for a cell to count as marked
+MIN_FILL_RATIO = 0.05
+
+# Fiducial answer grid (services/layout_service.py)
+MARKER_DETECT_MIN_SIDE = 1000   # Markers are searched on a pyramid level at least this size
+MIN_MARKERS = 3                 # Corner markers needed for the homography
+PX_PER_MM = 6                   # Resolution of the rectified grid
+DARK_RATIO = 0.65               # A pixel is ink when darker than this fraction of the local paper
+MIN_BUBBLE_FILL = 0.3           # Fraction of a bubble's core that must be ink
+
+# Answer states besides the marked letter
+BLANK = 'BLANK'
+MULTIPLE = 'MULTIPLE'
+
+# A second mark at least this fraction of the strongest one is a double mark
+MULTIPLE_RATIO = 0.6
+
+# Questions read with a confidence below this send the sheet to human review
+REVIEW_CONFIDENCE = 0.5
+
+# Sheets with more than this fraction of blank questions go to review too:
+# a misregistered or wrong-page scan reads as a confidently blank sheet
+MAX_BLANK_RATIO = 0.5
+
+_qr_detector = None
+_qr_detector_aruco = None
+_aruco_detectors = {}
+
+# cv2 flags decoding straight to grayscale, optionally downscaled by the
+# JPEG decoder itself (DCT scaling, much cheaper than decode + resize)
+_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+def count_pages(path):
+    """Number of frames of an image file (pages of a multi-page TIFF, 1 otherwise)."""
+    if path.lower().endswith(MULTIPAGE_EXTENSIONS):
+        return cv2.imcount(path)
+    return 1
+
+def load_image(source, reduce=1, min_side=0, page=None):
+    """
+    Decode a sheet image to grayscale, the only channel the OMR uses.
+
+    Args:
+        source: A file path, the encoded image bytes (bytes, bytearray,
+            memoryview) or a file-like object such as an uploaded FileStorage.
+        reduce (int): Decode at 1/reduce of the size (1, 2, 4 or 8).
+        min_side (int): Decode again at full size when the reduced image
+            would have a shorter side below this.
+        page (int): Frame of a multi-page TIFF file to read (only that
+            frame is decoded).
+
+    Returns:
+        ndarray: Grayscale image.
+    """
+    if page is not None:
+        return _load_page(source, page, reduce, min_side)
+
+    if hasattr(source, 'read'):
+        source = source.read()
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(source, dtype=np.uint8)
+        decode = lambda flags: cv2.imdecode(buf, flags)
+    else:
+        decode = lambda flags: cv2.imread(source, flags)
+
+    img = decode(_DECODE_FLAGS.get(reduce, cv2.IMREAD_GRAYSCALE))
+    if img is not None and reduce > 1 and min(img.shape[:2]) < min_side:
+        img = decode(cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Could not load image")
+    return img
+
+def _load_page(path, page, reduce, min_side):
+    ok, frames = cv2.imreadmulti(path, start=page, count=1, flags=cv2.IMREAD_GRAYSCALE)
+    if not ok or not frames:
+        raise ValueError(f"Could not load page {page + 1}")
+    img = frames[0]
+    # The TIFF decoder has no reduced mode; shrink after decoding instead
+    if reduce > 1 and min(img.shape[:2]) // reduce >= min_side:
+        img = cv2.resize(img, None, fx=1 / reduce, fy=1 / reduce, interpolation=cv2.INTER_AREA)
+    return img
+
+def decode_qr_code(img):
+    """
+    Decode the version QR code printed on the sheet.
+
+    Args:
+        img (ndarray): BGR or grayscale image of the sheet.
+
+    Returns:
+        str: The ExamVersion.unique_code, or None if no QR code was found.
+    """
+    global _qr_detector, _qr_detector_aruco
+    if _qr_detector is None:
+        _qr_detector = cv2.QRCodeDetector()
+        # Finds codes the classic detector misses next to other dark
+        # patterns (text lines, the answer grid markers)
+        _qr_detector_aruco = cv2.QRCodeDetectorAruco() if hasattr(cv2, 'QRCodeDetectorAruco') else None
+
+    h, w = img.shape[:2]
+    scale = QR_DETECT_MAX_SIDE / max(h, w)
+    candidates = []
+    if scale < 1:
+        candidates.append(cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+    # Fallback to the full frame when the code is too small once downscaled
+    candidates.append(img)
+
+    detectors = [_qr_detector] + ([_qr_detector_aruco] if _qr_detector_aruco is not None else [])
+    for detector in detectors:
+        for frame in candidates:
+            data, _, _ = detector.detectAndDecode(frame)
+            if data:
+                match = UNIQUE_CODE_RE.search(data.lower())
+                if match:
+                    return match.group(0)
+    return None
+
+def _aruco_detector(dictionary):
+    detector = _aruco_detectors.get(dictionary)
+    if detector is None:
+        aruco_dict = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, dictionary))
+        detector = cv2.aruco.ArucoDetector(aruco_dict, cv2.aruco.DetectorParameters())
+        _aruco_detectors[dictionary] = detector
+    return detector
+
+def locate_grid(gray, layout, levels=None, trace=None):
+    """
+    Find the corner markers of a fiducial answer grid.
+
+    Markers are detected on a pyramid level (as in find_table) and matched
+    by id to their printed position, so no contour search is needed.
+    The time is recorded as the 'contours' stage of `trace`.
+
+    Returns:
+        ndarray: 3x3 homography from image pixels to the rectified grid
+        (layout mm * PX_PER_MM), or None when fewer than MIN_MARKERS
+        markers are visible.
+    """
+    trace = trace or SheetTrace()
+    with trace.stage('contours'):
+        return _locate_grid(gray, layout, levels, trace)
+
+def _locate_grid(gray, layout, levels, trace):
+    small = gray
+    if levels is None:
+        levels = 0
+        while min(small.shape[:2]) // 2 >= MARKER_DETECT_MIN_SIDE:
+            small = cv2.pyrDown(small)
+            levels += 1
+    else:
+        for _ in range(levels):
+            small = cv2.pyrDown(small)
+
+    corners, ids, _ = _aruco_detector(layout['dictionary']).detectMarkers(small)
+    if trace.dumping:
+        markers = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+        if ids is not None:
+            cv2.aruco.drawDetectedMarkers(markers, corners, ids)
+        trace.image('markers', markers)
+    if ids is None:
+        return None
+
+    size = layout['marker_size']
+    src, dst = [], []
+    seen = set()
+    for marker_corners, marker_id in zip(corners, ids.flatten().tolist()):
+        position = layout['markers'].get(str(marker_id))
+        if position is None or marker_id in seen:
+            continue
+        seen.add(marker_id)
+        x, y = position
+        src.extend(marker_corners.reshape(4, 2) * (2 ** levels))
+        # ArUco corners are clockwise from the marker's top-left
+        dst.extend([[x, y], [x + size, y], [x + size, y + size], [x, y + size]])
+
+    if len(seen) < MIN_MARKERS:
+        return None
+
+    H, _ = cv2.findHomography(np.float32(src), np.float32(dst) * PX_PER_MM)
+    return H
+
+def _sampling_plan(layout):
+    """
+    Integral image indices of the core of every bubble, computed once per
+    layout (and kept in it) so sampling a sheet is pure index arithmetic.
+    """
+    plan = layout.get('_plan')
+    if plan is None:
+        num_questions = len(layout['cells'])
+        max_alternatives = max(layout['alternatives']) if layout['alternatives'] else 0
+        centres = np.zeros((num_questions, max_alternatives, 2))
+        valid = np.zeros((num_questions, max_alternatives), dtype=bool)
+        for q, cells in enumerate(layout['cells']):
+            centres[q, :len(cells)] = cells
+            valid[q, :len(cells)] = True
+
+        # Square inscribed in the bubble, away from the printed outline
+        half = layout['bubble_radius'] * 0.6 * PX_PER_MM
+        centres = centres * PX_PER_MM
+        x0 = np.round(centres[..., 0] - half).astype(np.intp)
+        x1 = np.round(centres[..., 0] + half).astype(np.intp)
+        y0 = np.round(centres[..., 1] - half).astype(np.intp)
+        y1 = np.round(centres[..., 1] + half).astype(np.intp)
+        area = np.where(valid, (x1 - x0) * (y1 - y0), 0)
+
+        size = (int(np.ceil(layout['width'] * PX_PER_MM)), int(np.ceil(layout['height'] * PX_PER_MM)))
+        kernel = 2 * int(np.ceil(layout['bubble_radius'] * PX_PER_MM)) + 1
+        plan = layout['_plan'] = (x0, x1, y0, y1, area, size, kernel)
+    return plan
+
+def measure_bubbles(gray, layout, levels=None, trace=None):
+    """
+    Fill ratio of every bubble of a fiducial answer grid.
+
+    Returns:
+        ndarray: float32 matrix (num_questions, max_alternatives), zero for
+        alternatives a question does not have, or None if the markers were
+        not found.
+    """
+    trace = trace or SheetTrace()
+    H = locate_grid(gray, layout, levels, trace)
+    if H is None:
+        return None
+
+    x0, x1, y0, y1, area, size, kernel = _sampling_plan(layout)
+    with trace.stage('warp'):
+        warped = cv2.warpPerspective(gray, H, size, borderValue=255)
+
+    # Flat-field: compare each pixel to the paper around it (a max filter
+    # wider than a bubble removes the marks), so shadows are not ink
+    with trace.stage('threshold'):
+        paper = cv2.dilate(warped, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * kernel, 2 * kernel)))
+        ink = (warped < paper * DARK_RATIO).astype(np.uint8)
+    trace.image('warped', warped)
+    if trace.dumping:
+        trace.image('ink', ink * 255)
+
+    with trace.stage('sampling'):
+        integral = cv2.integral(ink, sdepth=cv2.CV_32S)
+        sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        return np.divide(sums, area, out=np.zeros(area.shape), where=area > 0).astype(np.float32)
+
+def process_exam_image(image_path, num_questions, num_alternatives=None, grid_alternatives=SHEET_ALTERNATIVES, layout=None):
     """
     Process the exam image to identify marked answers.
     
     Args:
-        image_path (str): Path to the image file.
+        image_path (str): Path to the image file, or its bytes (see load_image).
         num_questions (int): Number of questions in the exam.
+        num_alternatives (int or list): Alternatives of each question (4 or 5).
+            Defaults to every printed column.
+        grid_alternatives (int): Alternative columns printed in the table.
+        layout (dict): Stored layout of the version (layout_service). When
+            given, the fiducial answer grid is read; sheets printed with the
+            old answer table fall back to table detection.
         
     Returns:
-        dict: A dictionary mapping question number (int) to detected answer ('A', 'B', 'C', 'D').
+        dict: A dictionary mapping question number (int) to detected answer ('A' to 'E').
     """
-    # 1. Load Image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError("Could not load image")
+    # 1. Load Image (stage timings go to services/omr_trace.py)
+    trace = new_trace()
+    with trace.stage('decode'):
+        img = load_image(image_path)
+    result = read_sheet(img, num_questions, num_alternatives, grid_alternatives, layout=layout, trace=trace)
+    finish(trace, image_path if isinstance(image_path, str) else None)
+    return result['answers']
+
+def find_table(gray, levels=None, trace=None):
+    """
+    Locate the answer table corners on a coarse pyramid level.
+
+    Contour search does not need the full resolution of a phone photo, so it
+    runs on the image reduced by pyrDown `levels` times (each level halves
+    the sides). The corners are scaled back to full-resolution coordinates.
+
+    Args:
+        gray (ndarray): Full-resolution grayscale image.
+        levels (int): Pyramid levels to go down. Defaults to as many as
+            possible (up to TABLE_DETECT_LEVELS) keeping the shorter side
+            above TABLE_DETECT_MIN_SIDE.
+        trace (SheetTrace): Receives the 'threshold' and 'contours' timings.
+
+    Returns:
+        ndarray: float32 (4, 2) corners ordered top-left, top-right,
+        bottom-right, bottom-left, or None if no table was found.
+    """
+    trace = trace or SheetTrace()
+    with trace.stage('threshold'):
+        small = gray
+        if levels is None:
+            levels = 0
+            while levels < TABLE_DETECT_LEVELS and min(small.shape[:2]) // 2 >= TABLE_DETECT_MIN_SIDE:
+                small = cv2.pyrDown(small)
+                levels += 1
+        else:
+            for _ in range(levels):
+                small = cv2.pyrDown(small)
+
+        # 2. Preprocessing
+        blur = cv2.GaussianBlur(small, (5, 5), 0)
+        thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                       cv2.THRESH_BINARY_INV, 11, 2)
+    trace.image('thresh', thresh)
 
-    # 2. Preprocessing
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    thresh = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                   cv2.THRESH_BINARY_INV, 11, 2)
+    with trace.stage('contours'):
+        rect = _table_corners(thresh)
+    if rect is None:
+        return None
 
+    if trace.dumping:
+        contour = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+        cv2.polylines(contour, [rect.astype(np.int32)], True, (0, 0, 255), 2)
+        trace.image('contours', contour)
+
+    # Back to full-resolution coordinates
+    return rect * (2 ** levels)
+
+def _table_corners(thresh):
     # 3. Find Contours
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    # Sort contours by area, largest first
-    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+    # Only the largest contours are candidates, no need to sort them all
+    contours = heapq.nlargest(5, contours, key=cv2.contourArea)
     
     table_contour = None
     
     # Try to find a 4-point contour among the largest ones
-    for c in contours[:5]:
+    for c in contours:
         peri = cv2.arcLength(c, True)
         # Try different epsilons
         for eps in [0.02, 0.04, 0.06]:
@@ -53,9 +379,8 @@ def process_exam_image(image_path, num_questions):
             print("Using bounding box fallback")
         else:
             print("Table contour not found")
-            return {}
+            return None
 
-    # 4. Perspective Transform (Warp)
     # Order points: top-left, top-right, bottom-right, bottom-left
     pts = table_contour.reshape(4, 2)
     rect = np.zeros((4, 2), dtype="float32")
@@ -67,7 +392,44 @@ def process_exam_image(image_path, num_questions):
     diff = np.diff(pts, axis=1)
     rect[1] = pts[np.argmin(diff)]
     rect[3] = pts[np.argmax(diff)]
-    
+    return rect
+
+def read_answers(img, num_questions, num_alternatives=None, grid_alternatives=SHEET_ALTERNATIVES, detect_levels=None, layout=None):
+    """
+    Same as process_exam_image, for an image already in memory.
+
+    `detect_levels` is passed to find_table/locate_grid (0 detects at full resolution).
+    """
+    return read_sheet(img, num_questions, num_alternatives, grid_alternatives, detect_levels, layout)['answers']
+
+def read_sheet(img, num_questions, num_alternatives=None, grid_alternatives=SHEET_ALTERNATIVES, detect_levels=None, layout=None, trace=None):
+    """
+    Full OMR result of a sheet: answers plus the evidence behind them.
+
+    Takes the same arguments as read_answers, plus an optional SheetTrace
+    (services/omr_trace.py) receiving the stage timings and images.
+
+    Returns:
+        dict: analyze_fill result, with 'located' False (and every
+        question blank) when neither the grid nor the table was found.
+    """
+    trace = trace or SheetTrace()
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    if layout is not None:
+        fill = measure_bubbles(gray, layout, detect_levels, trace)
+        if fill is not None:
+            with trace.stage('sampling'):
+                return analyze_fill(fill, layout['alternatives'], MIN_BUBBLE_FILL)
+
+    rect = find_table(gray, detect_levels, trace)
+    if rect is None:
+        result = analyze_fill(np.zeros((num_questions, grid_alternatives), np.float32), num_alternatives)
+        result['located'] = False
+        result['needs_review'] = True
+        return result
+
+    # 4. Perspective Transform (Warp)
     (tl, tr, br, bl) = rect
     
     # Compute width of new image
@@ -86,65 +448,129 @@ def process_exam_image(image_path, num_questions):
         [maxWidth - 1, maxHeight - 1],
         [0, maxHeight - 1]], dtype="float32")
         
-    M = cv2.getPerspectiveTransform(rect, dst)
-    warped = cv2.warpPerspective(gray, M, (maxWidth, maxHeight))
-    warped_thresh = cv2.warpPerspective(thresh, M, (maxWidth, maxHeight))
+    # Only the table ROI is warped and thresholded at full resolution
+    with trace.stage('warp'):
+        M = cv2.getPerspectiveTransform(rect, dst)
+        warped = cv2.warpPerspective(gray, M, (maxWidth, maxHeight))
+    with trace.stage('threshold'):
+        warped_blur = cv2.GaussianBlur(warped, (5, 5), 0)
+        warped_thresh = cv2.adaptiveThreshold(warped_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                              cv2.THRESH_BINARY_INV, 11, 2)
+    trace.image('warped', warped)
+    trace.image('warped_thresh', warped_thresh)
 
-    # 5. Split into cells
-    # The table has (num_questions + 1) rows (header + questions)
-    # And 5 columns (Q, A, B, C, D)
-    
-    rows = num_questions + 1
-    cols = 5
-    
-    cell_height = maxHeight // rows
-    cell_width = maxWidth // cols
-    
-    detected_answers = {}
-    
-    # We skip the first row (header)
-    for q_idx in range(1, rows):
-        # Question number is q_idx
-        
-        # We check columns 1, 2, 3, 4 (A, B, C, D) - 0-indexed
-        # Column 0 is the question number
-        
-        best_col = -1
-        max_pixels = 0
-        
-        # Threshold for considering a bubble filled
-        # This might need tuning
-        
-        options = ['A', 'B', 'C', 'D']
-        pixel_counts = []
-        
-        for col_idx in range(1, 5):
-            # Extract cell ROI
-            start_y = q_idx * cell_height
-            end_y = (q_idx + 1) * cell_height
-            start_x = col_idx * cell_width
-            end_x = (col_idx + 1) * cell_width
-            
-            # Use the thresholded warped image to count white pixels (which correspond to dark marks in original)
-            # Note: In our thresh (BINARY_INV), dark marks became white.
-            # However, we might want to be careful about borders.
-            # Let's crop the cell slightly to avoid borders
-            margin = 5
-            cell_roi = warped_thresh[start_y+margin:end_y-margin, start_x+margin:end_x-margin]
-            
-            non_zero = cv2.countNonZero(cell_roi)
-            pixel_counts.append(non_zero)
-            
-            if non_zero > max_pixels:
-                max_pixels = non_zero
-                best_col = col_idx - 1 # 0 for A, 1 for B...
-        
-        # Heuristic: The filled bubble should have significantly more pixels than empty ones
-        # For now, we just take the max, but in a real system we'd check if it exceeds a threshold
-        # relative to the cell area or relative to other options.
-        
-        # Simple check: if max_pixels is very low, maybe nothing is marked
-        if max_pixels > 40: # Lowered threshold based on debug results
-             detected_answers[q_idx] = options[best_col]
-             
-    return detected_answers
+    # 5. Measure every cell at once and pick the darkest alternative
+    with trace.stage('sampling'):
+        fill = measure_fill(warped_thresh, num_questions, grid_alternatives)
+        return analyze_fill(fill, num_alternatives)
+
+def measure_fill(warped_thresh, num_questions, num_alternatives=SHEET_ALTERNATIVES, margin=5):
+    """
+    Fill ratio of every answer cell of the warped table.
+
+    The table has (num_questions + 1) rows (header + questions) and
+    (num_alternatives + 1) columns (Q, A, B, ...). Cell sums come from a
+    single integral image, so the cost in Python does not grow with the
+    number of cells.
+
+    Args:
+        warped_thresh (ndarray): Binary (0/255) top-down view of the table,
+            with marks in white.
+        num_questions (int): Number of question rows.
+        num_alternatives (int): Number of alternative columns printed.
+        margin (int): Pixels cropped from each cell side to skip the borders.
+
+    Returns:
+        ndarray: float32 matrix (num_questions, num_alternatives) with the
+        fraction of marked pixels of each cell.
+    """
+    height, width = warped_thresh.shape[:2]
+    cell_height = height // (num_questions + 1)
+    cell_width = width // (num_alternatives + 1)
+
+    # Skip the header row and the question number column
+    rows = np.arange(1, num_questions + 1)
+    cols = np.arange(1, num_alternatives + 1)
+    y0 = rows * cell_height + margin
+    y1 = np.maximum((rows + 1) * cell_height - margin, y0)
+    x0 = cols * cell_width + margin
+    x1 = np.maximum((cols + 1) * cell_width - margin, x0)
+
+    integral = cv2.integral(warped_thresh, sdepth=cv2.CV_32S)
+    sums = (integral[np.ix_(y1, x1)] - integral[np.ix_(y0, x1)]
+            - integral[np.ix_(y1, x0)] + integral[np.ix_(y0, x0)])
+
+    area = np.outer(y1 - y0, x1 - x0)
+    return np.divide(sums / 255.0, area, out=np.zeros(area.shape), where=area > 0).astype(np.float32)
+
+def analyze_fill(fill, num_alternatives=None, min_fill=MIN_FILL_RATIO):
+    """
+    Decide the state of each question from its fill ratios.
+
+    A question is BLANK when no alternative reaches `min_fill`, MULTIPLE
+    when a second alternative is marked with at least MULTIPLE_RATIO of the
+    strongest fill, and the strongest letter otherwise. The confidence is a
+    0-1 margin: how far the strongest fill is from the threshold for blanks,
+    how close the two marks are for double marks, and how far the answer is
+    from the runner-up (erasures, smudges) for answers. Sheets with double
+    marks, a low confidence or mostly blank questions need review.
+
+    Args:
+        fill (ndarray): Matrix returned by measure_fill or measure_bubbles.
+        num_alternatives (int or list): Alternatives of each question. Columns
+            beyond a question's alternatives are ignored. Defaults to all columns.
+        min_fill (float): Fill ratio below which a question is left blank.
+
+    Returns:
+        dict: {'answers': {question: letter}, 'states': {question: letter, BLANK or MULTIPLE},
+               'confidence': {question: float}, 'fill': [[float]], 'min_confidence': float,
+               'needs_review': bool, 'located': True}
+    """
+    fill = np.array(fill, dtype=np.float32)
+    if num_alternatives is not None:
+        limits = np.broadcast_to(np.asarray(num_alternatives), (fill.shape[0],))
+        fill[np.arange(fill.shape[1])[None, :] >= limits[:, None]] = 0
+
+    rows = np.arange(fill.shape[0])
+    order = np.argsort(-fill, axis=1)
+    top = fill[rows, order[:, 0]] if fill.shape[1] else np.zeros(fill.shape[0])
+    second = fill[rows, order[:, 1]] if fill.shape[1] > 1 else np.zeros(fill.shape[0])
+
+    blank = top <= min_fill
+    multiple = ~blank & (second > min_fill) & (second >= MULTIPLE_RATIO * top)
+    safe_top = np.where(top > 0, top, 1)
+    confidence = np.select(
+        [blank, multiple],
+        [1 - top / min_fill, second / safe_top],
+        (top - second) / safe_top
+    )
+    confidence = np.clip(confidence, 0, 1)
+
+    answers, states, confidences = {}, {}, {}
+    for q_idx, (col, is_blank, is_multiple, conf) in enumerate(
+            zip(order[:, 0].tolist(), blank.tolist(), multiple.tolist(), confidence.tolist())):
+        number = q_idx + 1
+        if is_blank:
+            states[number] = BLANK
+        elif is_multiple:
+            states[number] = MULTIPLE
+        else:
+            states[number] = answers[number] = OPTIONS[col]
+        confidences[number] = round(conf, 3)
+
+    min_confidence = min(confidences.values()) if confidences else 1.0
+    mostly_blank = bool(blank.size and blank.mean() > MAX_BLANK_RATIO)
+    return {
+        'answers': answers,
+        'states': states,
+        'confidence': confidences,
+        'fill': np.round(fill.astype(np.float64), 3).tolist(),
+        'min_confidence': min_confidence,
+        # Double marks are rare on real sheets and often mean a misread grid
+        'needs_review': min_confidence < REVIEW_CONFIDENCE or MULTIPLE in states.values() or mostly_blank,
+        'located': True,
+    }
+
+def answers_from_fill(fill, num_alternatives=None, min_fill=MIN_FILL_RATIO):
+    """Detected letters only (see analyze_fill)."""
+    return analyze_fill(fill, num_alternatives, min_fill)['answers']
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import random
+import shutil
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+# Per-stage timing of the OMR (services/omr_service.py). The stages are:
+#   decode     image bytes/file -> grayscale array
+#   threshold  binarization (adaptive threshold of the table, ink mask of the grid)
+#   contours   locating the sheet (table contours, or the ArUco markers)
+#   warp       perspective correction
+#   sampling   measuring the cells/bubbles and deciding the answers
+STAGES = ('decode', 'threshold', 'contours', 'warp', 'sampling')
+
+logger = logging.getLogger('omr')
+
+# Latest samples kept per stage for the percentiles
+WINDOW = 1000
+
+_lock = threading.Lock()
+_samples = {stage: deque(maxlen=WINDOW) for stage in STAGES + ('total',)}  # Other stage names are added when seen
+_counters = {'sheets': 0, 'slow_sheets': 0, 'dumps': 0}
+
+_settings = {'sample_rate': 0.0, 'dump_dir': None, 'max_dumps': 50, 'slow_seconds': 2.0}
+_dump_seq = 0
+
+
+class SheetTrace:
+    """Stage timings (and, when sampled, intermediate images) of one sheet."""
+
+    def __init__(self, dump=False):
+        self.timings = {}
+        self.images = {} if dump else None
+
+    @property
+    def dumping(self):
+        return self.images is not None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def image(self, name, img):
+        if self.images is not None:
+            self.images[name] = img
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+
+def configure(sample_rate=None, dump_dir=None, max_dumps=None, slow_seconds=None):
+    """Set the dump sampling (fraction of sheets, 0 disables it) and the slow sheet threshold."""
+    for name, value in (('sample_rate', sample_rate), ('dump_dir', dump_dir),
+                        ('max_dumps', max_dumps), ('slow_seconds', slow_seconds)):
+        if value is not None:
+            _settings[name] = value
+
+
+def settings():
+    return dict(_settings)
+
+
+def new_trace(force_dump=False):
+    """Trace for a new sheet, dumping its images for a sampled fraction of sheets."""
+    dump = force_dump or (_settings['dump_dir'] and _settings['sample_rate'] > 0
+                          and random.random() < _settings['sample_rate'])
+    return SheetTrace(dump=bool(dump))
+
+
+def finish(trace, label=None):
+    """Record the timings of a finished sheet, log them and write the sampled dump."""
+    total = trace.total
+    with _lock:
+        for stage, seconds in trace.timings.items():
+            _samples.setdefault(stage, deque(maxlen=WINDOW)).append(seconds)
+        _samples['total'].append(total)
+        _counters['sheets'] += 1
+        slow = total >= _settings['slow_seconds']
+        if slow:
+            _counters['slow_sheets'] += 1
+
+    timings = ' '.join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in trace.timings.items())
+    if slow:
+        logger.warning("slow sheet %s: total=%.1fms %s", label or '-', total * 1000, timings)
+    else:
+        logger.debug("sheet %s: total=%.1fms %s", label or '-', total * 1000, timings)
+
+    if trace.dumping and _settings['dump_dir']:
+        try:
+            path = dump(trace, _settings['dump_dir'], label)
+            logger.info("OMR images of sheet %s written to %s", label or '-', path)
+        except OSError as e:
+            logger.warning("could not write OMR debug images: %s", e)
+
+
+def dump(trace, directory, label=None, max_dumps=None):
+    """
+    Write the images of a trace to a new subdirectory of `directory`, with
+    the timings in trace.json. Only the newest max_dumps subdirectories
+    are kept (OMR_DEBUG_MAX_SHEETS by default).
+
+    Returns:
+        str: The subdirectory written.
+    """
+    global _dump_seq
+    with _lock:
+        _dump_seq += 1
+        _counters['dumps'] += 1
+        seq = _dump_seq
+
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{seq:05d}"
+    path = os.path.join(directory, name)
+    os.makedirs(path, exist_ok=True)
+
+    for image_name, img in (trace.images or {}).items():
+        cv2.imwrite(os.path.join(path, f"{image_name}.png"), img)
+    with open(os.path.join(path, 'trace.json'), 'w') as f:
+        json.dump({'label': label, 'timings_ms': {k: round(v * 1000, 2) for k, v in trace.timings.items()}}, f, indent=2)
+
+    _rotate(directory, max_dumps if max_dumps is not None else _settings['max_dumps'])
+    return path
+
+
+def _rotate(directory, keep):
+    # Names start with the timestamp, so sorting them sorts by age
+    entries = sorted(entry for entry in os.listdir(directory) if os.path.isdir(os.path.join(directory, entry)))
+    for entry in entries[:max(len(entries) - keep, 0)]:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+def metrics():
+    """
+    Stage statistics of the sheets processed by this process.
+
+    Returns:
+        dict: {'sheets', 'slow_sheets', 'dumps', 'stages': {stage: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'}}}
+    """
+    with _lock:
+        samples = {stage: np.array(values) for stage, values in _samples.items()}
+        result = dict(_counters)
+
+    stages = {}
+    for stage, values in samples.items():
+        if not len(values):
+            continue
+        ms = values * 1000
+        stages[stage] = {
+            'count': int(len(ms)),
+            'mean_ms': round(float(ms.mean()), 2),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        }
+    result['stages'] = stages
+    return result
+
+
+def reset():
+    with _lock:
+        for values in _samples.values():
+            values.clear()
+        for name in _counters:
+            _counters[name] = 0
@@ -0,0 +1,383 @@
+import io
+import os
+import re
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+# Compiled PDFs cached on disk by content: the key is the hash of the
+# rendered .tex (which embeds everything the document draws, QR codes
+# included) and of the compile command. An unchanged exam is never
+# compiled twice, and the key doubles as the ETag of the download.
+# Least recently used PDFs are deleted once the cache outgrows
+# PDF_CACHE_MAX_BYTES.
+#
+# Every version of an exam is a document of its own: the versions are
+# compiled in parallel, each is cached on its own (editing one version
+# recompiles only that one), and the exam PDF is their concatenation
+# with pdfpages, cached under the keys of its parts.
+#
+# Loading the packages of the preamble is most of the compile time of a
+# short exam. The preamble (everything before END_OF_DUMP) is dumped once
+# into a format file with mylatexformat, named after its hash so a
+# template change builds a new one, and documents are compiled with
+# that format. When the format cannot be built or used, documents are
+# compiled normally: without the format, END_OF_DUMP does nothing.
+#
+# pdflatex runs again only while the log asks for it or the auxiliary
+# files it reads back keep changing, at most MAX_RUNS times; most exams
+# need a single run.
+
+PDFLATEX = ['pdflatex', '-interaction=nonstopmode']
+
+END_OF_DUMP = '\\csname endofdump\\endcsname'
+
+# Bump when the build changes in a way the .tex does not show
+BUILD_FORMAT = 1
+
+MAX_RUNS = 4
+
+# Files written by one run and read by the next
+AUX_EXTENSIONS = ('.aux', '.toc', '.lof', '.lot', '.out')
+EMPTY_DIGEST = hashlib.sha1(b'').hexdigest()
+
+RERUN_RE = re.compile(r'Rerun to get|Rerun LaTeX|Label\(s\) may have changed|\(rerunfilecheck\)')
+# Only worth another run when the .aux (where labels are defined) changed:
+# a dangling \ref stays undefined however many times it runs
+UNDEFINED_RE = re.compile(r'There were undefined references')
+# "! Message" followed, a few lines later, by "l.<line> <source>"
+ERROR_RE = re.compile(r'^! (?P<message>.+?)\n(?:.*\n){0,8}?l\.(?P<line>\d+) (?P<context>.*)$', re.MULTILINE)
+# Errors reported per failed compile
+MAX_ERRORS = 5
+# pdflatex could not load the format (missing, or built by another version)
+FORMAT_ERROR_RE = re.compile(r"can't find the format file|Fatal format file error|format file .*(?:was written by|made by)")
+
+logger = logging.getLogger(__name__)
+
+# Formats that failed to build or to compile a document in this process
+# (not retried)
+_failed_formats = set()
+_format_lock = threading.Lock()
+
+
+class LatexError(Exception):
+    """
+    pdflatex failed or produced no PDF.
+
+    Attributes:
+        errors (list): {'message', 'line', 'context'} of the first errors of
+            the log; line is the line of the .tex file.
+        log (str): End of the pdflatex log.
+    """
+
+    def __init__(self, message, errors=None, log=''):
+        super().__init__(message)
+        self.errors = errors or []
+        self.log = log
+
+    def __str__(self):
+        if not self.errors:
+            return self.args[0]
+        return '; '.join(f"{error['message']} (linha {error['line']}: {error['context']})" for error in self.errors)
+
+
+def parse_log_errors(log):
+    """The first MAX_ERRORS errors of a pdflatex log."""
+    return [
+        {'message': match.group('message').strip(), 'line': int(match.group('line')),
+         'context': match.group('context').strip()}
+        for match in ERROR_RE.finditer(log)
+    ][:MAX_ERRORS]
+
+
+def _aux_state(directory, jobname):
+    state = {}
+    for ext in AUX_EXTENSIONS:
+        try:
+            with open(os.path.join(directory, jobname + ext), 'rb') as f:
+                state[ext] = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            pass
+    return state
+
+
+def _needs_rerun(log, before, after, first):
+    if RERUN_RE.search(log):
+        return True
+    changed = {ext for ext, digest in after.items() if digest != before.get(ext, EMPTY_DIGEST)}
+    if '.aux' in changed and UNDEFINED_RE.search(log):
+        return True
+    if first:
+        # Always written on the first run; what it holds only matters for
+        # cross-references, which the log reports as undefined
+        changed.discard('.aux')
+    return bool(changed)
+
+
+
+def cache_key(latex_content):
+    digest = hashlib.sha256()
+    digest.update(f"{BUILD_FORMAT}:{' '.join(PDFLATEX)}\n".encode())
+    digest.update(latex_content.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(current_app.config['PDF_CACHE_DIR'], f"{key}.pdf")
+
+
+def _format_dir():
+    return os.path.join(current_app.config['PDF_CACHE_DIR'], 'formats')
+
+
+def _format_name(fmt):
+    return os.path.splitext(os.path.basename(fmt))[0]
+
+
+def _format_failure(error, latex_content):
+    """Whether a compile with the format failed because of the format or the preamble."""
+    if FORMAT_ERROR_RE.search(error.log) or FORMAT_ERROR_RE.search(error.args[0]):
+        return True
+    # With the format, the preamble comes from the dump: an error in the
+    # body would be the same without it
+    preamble_lines = latex_content[:latex_content.find(END_OF_DUMP)].count('\n') + 1
+    return not any(e['line'] > preamble_lines for e in error.errors)
+
+
+def preamble_format(latex_content):
+    """
+    Path of the precompiled format of a document's preamble, building it
+    on first use.
+
+    Returns:
+        str: The .fmt file, or None when the document has no END_OF_DUMP
+        marker or the format cannot be built.
+    """
+    end = latex_content.find(END_OF_DUMP)
+    if end < 0:
+        return None
+    preamble = latex_content[:end]
+    name = 'exam-' + hashlib.sha256(f"{BUILD_FORMAT}:{preamble}".encode('utf-8')).hexdigest()[:16]
+    directory = _format_dir()
+    path = os.path.join(directory, f"{name}.fmt")
+
+    with _format_lock:
+        if name in _failed_formats:
+            return None
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, 'preamble.tex'), 'w', encoding='utf-8') as f:
+                f.write(preamble + END_OF_DUMP + '\n\\begin{document}\n\\end{document}\n')
+            result = subprocess.run(
+                ['pdflatex', '-ini', '-interaction=nonstopmode', f'-jobname={name}', '&pdflatex', 'mylatexformat.ltx', 'preamble.tex'],
+                cwd=temp_dir, capture_output=True, text=True
+            )
+            built = os.path.join(temp_dir, f"{name}.fmt")
+            if result.returncode != 0 or not os.path.exists(built):
+                logger.warning("could not precompile the LaTeX preamble, compiling without a format: %s",
+                               result.stdout[-500:])
+                _failed_formats.add(name)
+                return None
+
+            tmp_path = f"{path}.{os.getpid()}.part"
+            shutil.copyfile(built, tmp_path)
+            os.replace(tmp_path, path)
+
+        # Formats of older templates
+        for entry in os.listdir(directory):
+            if entry.endswith('.fmt') and entry != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(directory, entry))
+                except OSError:
+                    pass
+    return path
+
+
+def compile_latex(latex_content, output_path, files=None, fmt=None):
+    """
+    Compile a document with pdflatex and write the PDF to output_path.
+
+    Args:
+        files (dict): Extra input files, name in the build directory -> path.
+        fmt (str): Precompiled format of the preamble (preamble_format).
+            When the format or the preamble makes the compile fail, the
+            format is not used again and the document is compiled without
+            it; errors in the body are raised as they are.
+    """
+    if fmt is not None and _format_name(fmt) not in _failed_formats:
+        try:
+            return _compile(latex_content, output_path, files, fmt)
+        except LatexError as e:
+            if not _format_failure(e, latex_content):
+                raise
+            logger.warning("compile with format %s failed, retrying without it", os.path.basename(fmt))
+            with _format_lock:
+                _failed_formats.add(_format_name(fmt))
+    return _compile(latex_content, output_path, files)
+
+
+def _compile(latex_content, output_path, files=None, fmt=None):
+    command = PDFLATEX[:]
+    env = None
+    if fmt is not None:
+        command.append(f'-fmt={_format_name(fmt)}')
+        # The trailing separator keeps the default format search path
+        env = dict(os.environ, TEXFORMATS=os.path.dirname(fmt) + os.pathsep)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, source in (files or {}).items():
+            shutil.copyfile(source, os.path.join(temp_dir, name))
+
+        tex_file_path = os.path.join(temp_dir, 'exam.tex')
+        with open(tex_file_path, 'w', encoding='utf-8') as f:
+            f.write(latex_content)
+
+        # Rerun only while references or auxiliary files are still settling
+        for run in range(MAX_RUNS):
+            before = _aux_state(temp_dir, 'exam')
+            result = subprocess.run(command + ['exam.tex'], cwd=temp_dir, capture_output=True, text=True, env=env)
+            try:
+                with open(os.path.join(temp_dir, 'exam.log'), encoding='utf-8', errors='replace') as f:
+                    log = f.read()
+            except OSError:
+                log = result.stdout
+            if result.returncode != 0:
+                errors = parse_log_errors(log)
+                raise LatexError(f"PDFLaTeX failed: {(result.stderr or log)[-1000:]}", errors, log[-5000:])
+            if not _needs_rerun(log, before, _aux_state(temp_dir, 'exam'), first=run == 0):
+                break
+        else:
+            logger.warning("LaTeX output still changing after %d runs", MAX_RUNS)
+
+        pdf_file_path = os.path.join(temp_dir, 'exam.pdf')
+        if not os.path.exists(pdf_file_path):
+            raise LatexError('O arquivo PDF não foi gerado.')
+
+        # Moved in under a temporary name so readers never see a partial file
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+        shutil.copyfile(pdf_file_path, tmp_path)
+        os.replace(tmp_path, output_path)
+
+
+def _cached(key):
+    path = _cache_path(key)
+    if not os.path.exists(path):
+        return None
+    # The modification time orders the LRU eviction
+    os.utime(path)
+    return path
+
+
+def cached_pdfs(documents, workers=None):
+    """
+    Compiled PDFs of several documents, compiling the ones not cached yet
+    in parallel. Threads are enough: each one just waits for its own
+    pdflatex process.
+
+    Args:
+        documents (list): LaTeX sources.
+        workers (int): Concurrent compiles. Defaults to PDF_WORKERS.
+
+    Returns:
+        list: (path, cache key) per document, in order.
+    """
+    keys = [cache_key(latex_content) for latex_content in documents]
+    paths = [_cached(key) for key in keys]
+
+    missing = {}
+    for latex_content, key, path in zip(documents, keys, paths):
+        if path is None:
+            missing[key] = latex_content
+    if missing:
+        os.makedirs(current_app.config['PDF_CACHE_DIR'], exist_ok=True)
+        workers = min(workers or current_app.config['PDF_WORKERS'], len(missing))
+        targets = {key: _cache_path(key) for key in missing}
+        # Versions of an exam share the preamble: one format for all
+        formats = [preamble_format(latex_content) for latex_content in missing.values()]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first compile error
+            list(pool.map(compile_latex, missing.values(), targets.values(), [None] * len(missing), formats))
+        evict(current_app.config['PDF_CACHE_MAX_BYTES'], keep={_cache_path(key) for key in keys})
+
+    return [(_cache_path(key), key) for key in keys]
+
+
+def merged_pdf(parts):
+    """
+    One PDF with the pages of all parts, built with pdfpages and cached
+    under the keys of the parts.
+
+    Args:
+        parts (list): (path, cache key) tuples, as returned by cached_pdfs.
+
+    Returns:
+        tuple: (path, cache key)
+    """
+    if len(parts) == 1:
+        return parts[0]
+
+    key = hashlib.sha256(f"merge:{BUILD_FORMAT}:{','.join(key for _, key in parts)}".encode()).hexdigest()
+    path = _cached(key)
+    if path is not None:
+        return path, key
+
+    # The parts are copied next to the document: cache paths may contain spaces
+    files = {f"part{i:03d}.pdf": part_path for i, (part_path, _) in enumerate(parts)}
+    latex_content = '\n'.join(
+        ['\\documentclass{article}', '\\usepackage{pdfpages}', '\\begin{document}']
+        + [f"\\includepdf[pages=-]{{{name}}}" for name in files]
+        + ['\\end{document}']
+    )
+    path = _cache_path(key)
+    compile_latex(latex_content, path, files)
+    evict(current_app.config['PDF_CACHE_MAX_BYTES'], keep={path} | {part_path for part_path, _ in parts})
+    return path, key
+
+
+def zip_pdfs(named_paths):
+    """ZIP archive (in memory) of (file name, path) PDFs."""
+    buffer = io.BytesIO()
+    # PDFs are already compressed
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for name, path in named_paths:
+            zf.write(path, name)
+    buffer.seek(0)
+    return buffer
+
+
+def evict(max_bytes, keep=()):
+    """Delete the least recently used PDFs until the cache fits in max_bytes. Returns how many."""
+    directory = current_app.config['PDF_CACHE_DIR']
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.pdf'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
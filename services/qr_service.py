@@ -1,8 +1,9 @@
 import qrcode
-import os
-from flask import current_app
 
-def generate_qr_code(data, filename):
+# Printed exams draw the QR code as vector graphics (qr_matrix): no image
+# files are generated.
+
+def _build_qr(data):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -11,9 +12,8 @@ def generate_qr_code(data, filename):
     )
     qr.add_data(data)
     qr.make(fit=True)
+    return qr
 
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    path = os.path.join(current_app.config['QR_FOLDER'], filename)
-    img.save(path)
-    return path
+def qr_matrix(data):
+    """Modules of the QR code of `data`, quiet zone included (rows of booleans, True is black)."""
+    return _build_qr(data).get_matrix()
@@ -0,0 +1,116 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import event, func, insert, inspect, update
+from sqlalchemy.orm import Session
+
+from models import db, Question, QuestionCount
+from services.selection_service import DIFFICULTIES
+
+# QuestionCount holds the number of questions of each (category,
+# difficulty), so the create-exam form and create_exam_logic know what is
+# available without reading the Question table. The counts follow every
+# flush that adds, edits or deletes questions through the ORM; bulk
+# Query.delete() calls bypass the session and must call rebuild().
+
+
+def normalized_difficulty(difficulty):
+    """Difficulty a question is counted and drawn under (missing ones are the column default)."""
+    return difficulty or Question.difficulty.default.arg
+
+
+def _key(category_id, difficulty):
+    return category_id, normalized_difficulty(difficulty)
+
+
+def _committed(question, name):
+    # Value before the pending changes of this flush
+    history = inspect(question).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(question, name)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_changes(session, flush_context):
+    delta = Counter()
+    for question in session.new:
+        if isinstance(question, Question):
+            delta[_key(question.category_id, question.difficulty)] += 1
+    for question in session.deleted:
+        if isinstance(question, Question):
+            delta[_key(_committed(question, 'category_id'), _committed(question, 'difficulty'))] -= 1
+    for question in session.dirty:
+        if isinstance(question, Question) and session.is_modified(question):
+            old = _key(_committed(question, 'category_id'), _committed(question, 'difficulty'))
+            new = _key(question.category_id, question.difficulty)
+            if old != new:
+                delta[old] -= 1
+                delta[new] += 1
+
+    connection = session.connection()
+    for (category_id, difficulty), change in delta.items():
+        if not change:
+            continue
+        updated = connection.execute(
+            update(QuestionCount)
+            .where(QuestionCount.category_id == category_id, QuestionCount.difficulty == difficulty)
+            .values(count=QuestionCount.count + change)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(QuestionCount).values(category_id=category_id, difficulty=difficulty,
+                                                            count=max(change, 0)))
+
+
+def rebuild():
+    """Recount everything from the Question table (after bulk changes). Does not commit."""
+    db.session.flush()
+    db.session.execute(QuestionCount.__table__.delete())
+    counts = Counter()
+    rows = db.session.query(Question.category_id, Question.difficulty, func.count(Question.id)) \
+        .group_by(Question.category_id, Question.difficulty)
+    # Normalized like the after_flush upkeep, so both agree on the keys
+    for category_id, difficulty, count in rows:
+        counts[_key(category_id, difficulty)] += count
+    if counts:
+        db.session.execute(insert(QuestionCount), [
+            {'category_id': category_id, 'difficulty': difficulty, 'count': count}
+            for (category_id, difficulty), count in counts.items()
+        ])
+
+
+def ensure_counts():
+    """Fill the table the first time the application runs with it."""
+    if db.session.query(QuestionCount.category_id).first() is None:
+        rebuild()
+        db.session.commit()
+
+
+def availability(category_ids=None):
+    """
+    Returns:
+        dict: category_id -> {difficulty: count, ..., 'total': count}, with
+        every difficulty present. The total only counts the difficulties
+        the selector draws from (selection_service.DIFFICULTIES).
+    """
+    counts = defaultdict(lambda: dict.fromkeys(DIFFICULTIES + ('total',), 0))
+    query = QuestionCount.query
+    if category_ids is not None:
+        query = query.filter(QuestionCount.category_id.in_(category_ids))
+    for row in query:
+        counts[row.category_id][row.difficulty] = counts[row.category_id].get(row.difficulty, 0) + row.count
+        if row.difficulty in DIFFICULTIES:
+            counts[row.category_id]['total'] += row.count
+    return counts
+
+
+def check_feasibility(distribution_config):
+    """
+    Raise ValueError when a category has fewer questions the selector can
+    draw (see availability) than the largest count a version may ask of it.
+    """
+    available = availability([int(cat_id) for cat_id in distribution_config])
+    for cat_id, config in distribution_config.items():
+        needed = config['max'] if isinstance(config, dict) else config
+        total = available[int(cat_id)]['total']
+        if needed > total:
+            raise ValueError(f"Não há questões suficientes na categoria ID {cat_id}. Necessário: {needed}, Disponível: {total}.")
@@ -0,0 +1,202 @@
+import math
+import random
+from collections import defaultdict
+
+# Assignment of the pool questions to all the versions of an exam at once.
+#
+# Every (category, difficulty) bucket is dealt like a deck of cards: the
+# versions take questions from the top of a shuffled round, and a new
+# round is only shuffled when every question of the bucket has been used
+# once more. Exposure is therefore as even as the pool allows: within a
+# bucket, no question appears in more than one version more than any
+# other. Every version gets the same difficulty quotas for the same
+# number of questions, and a final pass swaps questions of the same
+# bucket between heavy and light versions to even out the total weight
+# without changing any exposure count. The cost grows linearly with the
+# number of versions and questions.
+
+DIFFICULTIES = ('Fácil', 'Médio', 'Difícil')
+
+# Rounds of heavy/light version pairing of the weight balancing pass
+BALANCE_PASSES = 3
+
+
+class _Deck:
+    """Round-robin draws from one bucket of the pool."""
+
+    def __init__(self, items, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.round = []
+
+    def draw(self, k):
+        """k distinct questions, the least used of the bucket first."""
+        taken = []
+        while len(taken) < k:
+            if not self.round:
+                self.round = self.items[:]
+                self.rng.shuffle(self.round)
+                # Questions already taken by this version wait for the next draw
+                if taken:
+                    taken_ids = {q.id for q in taken}
+                    self.round.sort(key=lambda q: q.id in taken_ids, reverse=True)
+            taken.append(self.round.pop())
+        return taken
+
+
+def _count(config, rng):
+    if isinstance(config, dict) and 'min' in config and 'max' in config:
+        return rng.randint(config['min'], config['max'])
+    if isinstance(config, int):
+        return config
+    return 0
+
+
+def _quotas(count, sizes, shares):
+    """
+    Questions of each difficulty for `count` questions of a category.
+
+    The targets follow the difficulty percentages; what a difficulty lacks
+    moves to the next one, and what is still missing at the end is taken
+    from any difficulty with questions left.
+
+    Returns:
+        list: Quota per difficulty, or None when the category is too small.
+    """
+    target_easy = int(count * shares[0])
+    target_medium = int(count * shares[1])
+    targets = [target_easy, target_medium, count - target_easy - target_medium]
+
+    quotas = []
+    deficit = 0
+    for target, size in zip(targets, sizes):
+        quota = min(target + deficit, size)
+        deficit = target + deficit - quota
+        quotas.append(quota)
+
+    for d, size in enumerate(sizes):
+        extra = min(deficit, size - quotas[d])
+        quotas[d] += extra
+        deficit -= extra
+
+    return None if deficit else quotas
+
+
+def assign_questions(pool, distribution_config, num_versions, difficulty_config, rng=random, max_exposure=None, progress=None):
+    """
+    Choose the questions of every version of an exam.
+
+    Args:
+        pool (dict): (category_id, difficulty) -> list of questions with
+            `id` and `weight` (exam_service.load_question_pool).
+        distribution_config (dict): category_id -> count or {'min', 'max'}.
+        num_versions (int): Number of versions.
+        difficulty_config (dict): {'easy', 'medium', 'hard'} percentages.
+        rng: random.Random (or the random module).
+        max_exposure (float): Maximum fraction of the versions a question
+            may appear in. None only balances the exposure (within one
+            version per bucket, see above) and never caps it: a small
+            bucket is reused in as many versions as needed.
+        progress: Called as progress(done, total) after the questions of
+            each version are drawn; it may raise to stop the assignment.
+
+    Raises:
+        ValueError: When a category has too few questions, or the exposure
+            limit cannot be met.
+
+    Returns:
+        list: One list of questions per version (grouped by category).
+    """
+    # Normalize percentages to 1.0
+    total_pct = sum(difficulty_config.values()) or 1
+    shares = (difficulty_config['easy'] / total_pct, difficulty_config['medium'] / total_pct)
+
+    decks = {}
+    demand = defaultdict(int)
+    versions = [[] for _ in range(num_versions)]
+    buckets = [defaultdict(list) for _ in range(num_versions)]
+
+    for i in range(num_versions):
+        for cat_id, config in distribution_config.items():
+            count = _count(config, rng)
+            if count <= 0:
+                continue
+
+            cat_id = int(cat_id)
+            sizes = [len(pool.get((cat_id, d), [])) for d in DIFFICULTIES]
+            quotas = _quotas(count, sizes, shares)
+            if quotas is None:
+                raise ValueError(f"Não há questões suficientes na categoria ID {cat_id} para preencher a versão {i+1}. Necessário: {count}, Disponível: {sum(sizes)}.")
+
+            for difficulty, quota in zip(DIFFICULTIES, quotas):
+                if not quota:
+                    continue
+                key = (cat_id, difficulty)
+                if key not in decks:
+                    decks[key] = _Deck(pool[key], rng)
+                picked = decks[key].draw(quota)
+                demand[key] += quota
+                versions[i].extend(picked)
+                buckets[i][key].extend(picked)
+
+        if progress:
+            progress(i + 1, num_versions)
+
+    if max_exposure is not None:
+        limit = max(1, int(max_exposure * num_versions))
+        for (cat_id, difficulty), total in demand.items():
+            needed = math.ceil(total / len(pool[(cat_id, difficulty)]))
+            if needed > limit:
+                raise ValueError(f"A categoria ID {cat_id} não tem questões de dificuldade {difficulty} suficientes para que cada uma apareça em no máximo {limit} versões (seriam necessárias {needed}).")
+
+    _balance_weights(versions, buckets)
+    return versions
+
+
+def _balance_weights(versions, buckets):
+    """Swap questions of the same bucket from heavier to lighter versions."""
+    weights = [sum(q.weight for q in questions) for questions in versions]
+    if len(versions) < 2 or max(weights) - min(weights) < 1e-9:
+        return
+
+    ids = [{q.id for q in questions} for questions in versions]
+
+    for _ in range(BALANCE_PASSES):
+        order = sorted(range(len(versions)), key=weights.__getitem__)
+        improved = False
+        for light, heavy in zip(order[:len(order) // 2], reversed(order[len(order) // 2:])):
+            for key, heavy_items in buckets[heavy].items():
+                gap = weights[heavy] - weights[light]
+                if gap < 1e-9:
+                    break
+                light_items = buckets[light].get(key)
+                if not light_items:
+                    continue
+
+                # The swap that brings both versions closest to their mean
+                best = None
+                for a, qa in enumerate(heavy_items):
+                    if qa.id in ids[light]:
+                        continue
+                    for b, qb in enumerate(light_items):
+                        delta = qa.weight - qb.weight
+                        if delta <= 0 or qb.id in ids[heavy]:
+                            continue
+                        remaining = abs(gap - 2 * delta)
+                        if remaining < gap and (best is None or remaining < best[0]):
+                            best = (remaining, a, b)
+                if best is None:
+                    continue
+
+                _, a, b = best
+                qa, qb = heavy_items[a], light_items[b]
+                heavy_items[a], light_items[b] = qb, qa
+                ids[heavy].remove(qa.id); ids[heavy].add(qb.id)
+                ids[light].remove(qb.id); ids[light].add(qa.id)
+                versions[heavy][versions[heavy].index(qa)] = qb
+                versions[light][versions[light].index(qb)] = qa
+                weights[heavy] -= qa.weight - qb.weight
+                weights[light] += qa.weight - qb.weight
+                improved = True
+        if not improved:
+            break
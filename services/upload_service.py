@@ -0,0 +1,71 @@
+import os
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Uploads are written off the request thread; the OMR works on the bytes
+# already in memory, so the response does not wait for the disk. A file
+# only appears under its name once fully written, so a submission records
+# an upload only when the file exists (stored_upload).
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+
+logger = logging.getLogger(__name__)
+
+def _write_file(path, data):
+    # Write to a temporary name of its own first so a half-written image is
+    # never served, even when the same file is uploaded twice at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
+
+def _log_failure(path, future):
+    error = future.exception()
+    if error is not None:
+        logger.error("could not save upload %s: %s", path, error)
+
+def save_upload(data, folder, filename, background=True):
+    """
+    Persist an uploaded file.
+
+    Args:
+        data (bytes): File contents.
+        folder (str): Destination folder (e.g. UPLOAD_FOLDER).
+        filename (str): Already sanitized file name.
+        background (bool): Write in a background thread.
+
+    Returns:
+        Future or str: The pending write, or the path when written inline.
+    """
+    path = os.path.join(folder, filename)
+    if background:
+        future = _writer.submit(_write_file, path, data)
+        future.add_done_callback(lambda f: _log_failure(path, f))
+        return future
+    return _write_file(path, data)
+
+def stored_upload(folder, filename, pending=None):
+    """
+    The file name to record for an upload, or None when it is not on disk
+    (the write failed, or was never made).
+
+    Args:
+        pending (Future): Write of the file started by this request, waited for.
+    """
+    if not filename:
+        return None
+    if pending is not None:
+        try:
+            pending.result()
+        except Exception:
+            # Already logged by _log_failure
+            return None
+    return filename if os.path.exists(os.path.join(folder, filename)) else None
@@ -2,7 +2,6 @@ from app import create_app
 from models import db, Category
 from services.exam_service import create_exam_logic
 from services.latex_service import generate_exam_latex
-import os
 
 app = create_app()
 
@@ -38,13 +37,12 @@ with app.app_context():
             
         print("LaTeX generated successfully at test_exam.tex")
         
-        # Check if QR codes exist
-        for v in exam.versions:
-            qr_path = os.path.join(app.config['QR_FOLDER'], f"{v.unique_code}.png")
-            if os.path.exists(qr_path):
-                print(f"QR Code found: {qr_path}")
-            else:
-                print(f"ERROR: QR Code not found: {qr_path}")
+        # Check if QR codes are drawn (vector graphics, no image files)
+        qr_codes = latex.count("\\path (0,0) rectangle (40,40);")
+        if qr_codes == len(exam.versions):
+            print(f"QR Codes found: {qr_codes}")
+        else:
+            print(f"ERROR: {qr_codes} QR Codes for {len(exam.versions)} versions")
                 
     except Exception as e:
         print(f"ERROR: {e}")